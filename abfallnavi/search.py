@@ -2,25 +2,66 @@
 """Search waste collection schedules via the Abfallnavi REST API."""
 
 import argparse
+import collections
+import concurrent.futures
+import csv
+import datetime
+import http.client
 import json
+import math
+import os
+import pathlib
+import random
+import re
+import sqlite3
 import sys
+import threading
+import tempfile
+import time
 import urllib.request
 import urllib.error
 import urllib.parse
 
+import httpclient
+
 REGIONS = [
     "aachen", "zew2", "aw-bgl2", "bav", "din", "dorsten", "gt2", "hlv",
     "coe", "krhs", "pi", "krwaf", "lindlar", "stl", "nds", "nuernberg",
     "roe", "solingen", "wml2",
 ]
 
+CACHE_DIR = pathlib.Path(tempfile.gettempdir()) / "abfallnavi_cache"
+# orte, strassen, hausnummern and fraktionen change rarely; collection dates are published per year
+LIST_TTL = 7 * 86400
+TERMINE_TTL = 12 * 3600
+MAX_CANDIDATES = 20
+STREET_INDEX = CACHE_DIR / "streets.sqlite"
+CRAWL_WORKERS = 16
+HOST_CONCURRENCY = 2
+SEARCH_LIMIT = 20
+FUZZY_MIN = 0.5
+BULK_WORKERS = 32
+BULK_PER_HOST = 4
+RETRIES = 3
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+PROGRESS_SECONDS = 5
+
+
+def region_url(region, path):
+    return f"https://{region}-abfallapp.regioit.de/abfall-app-{region}/rest{path}"
+
+
+def fetch_json(region, path):
+    """GET one API path. Raises on errors instead of exiting, for bulk use."""
+    req = urllib.request.Request(region_url(region, path), headers={"Accept": "application/json"})
+    with httpclient.urlopen(req, timeout=15) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
 
 def api_get(region, path):
-    url = f"https://{region}-abfallapp.regioit.de/abfall-app-{region}/rest{path}"
+    url = region_url(region, path)
     try:
-        req = urllib.request.Request(url, headers={"Accept": "application/json"})
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode("utf-8"))
+        return fetch_json(region, path)
     except urllib.error.HTTPError as e:
         print(json.dumps({"error": f"HTTP {e.code} for {url}"}))
         sys.exit(1)
@@ -29,6 +70,466 @@ def api_get(region, path):
         sys.exit(1)
 
 
+def cached_get(region, path, ttl, refresh=False, getter=api_get):
+    """getter (api_get) with a per-region file cache. Returns (data, fetched) where fetched tells if it hit the network."""
+    path_key = re.sub(r"[^\w-]+", "_", path.strip("/"))
+    cache_path = CACHE_DIR / region / f"{path_key}.json"
+    if not refresh:
+        try:
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+            if time.time() - cached["fetched"] < ttl:
+                return cached["data"], False
+        except (OSError, ValueError, KeyError):
+            pass
+    data = getter(region, path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"fetched": time.time(), "data": data}, f, ensure_ascii=False)
+    os.replace(tmp, cache_path)
+    return data, True
+
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+
+def normalize_name(name):
+    """Comparable form of a street or place name: folded umlauts/ß, 'str.' spelled out, no punctuation."""
+    name = name.casefold().translate(UMLAUTS)
+    name = re.sub(r"str\b\.?", "strasse", name)
+    return re.sub(r"[^a-z0-9]+", "", name)
+
+
+def normalize_nr(nr):
+    return re.sub(r"\s+", "", str(nr)).casefold()
+
+
+ADDRESS_RE = re.compile(r"^(?P<street>.*?\D)\s*(?P<nr>\d+\s*[a-zA-Z]?(?:\s*[-/]\s*\d+\s*[a-zA-Z]?)?)?$")
+
+
+def parse_address(address):
+    """Split "Straße 12a, Ort" into (street, house number or None, ort or None)."""
+    street_part, _, ort = address.partition(",")
+    m = ADDRESS_RE.match(street_part.strip())
+    street, nr = (m.group("street"), m.group("nr")) if m else (street_part, None)
+    return street.strip(), nr.strip() if nr else None, ort.strip() or None
+
+
+def pick(candidates, wanted, what):
+    """The entry whose normalised name equals wanted; else the only one containing it. Exits if ambiguous."""
+    key = normalize_name(wanted)
+    exact = [c for c in candidates if normalize_name(c["name"]) == key]
+    if len(exact) == 1:
+        return exact[0]
+    partial = exact or [c for c in candidates if key in normalize_name(c["name"])]
+    if len(partial) == 1:
+        return partial[0]
+    if not partial:
+        print(json.dumps({"error": f"No {what} matching '{wanted}'"}))
+    else:
+        print(json.dumps({"error": f"Ambiguous {what} '{wanted}'",
+                          "candidates": [{"id": c["id"], "name": c["name"]} for c in partial[:MAX_CANDIDATES]]}))
+    sys.exit(1)
+
+
+def cmd_lookup(args):
+    """Resolve an address to its collection dates: orte -> strassen -> hausnummern -> fraktionen + termine."""
+    region = args.region
+    street_name, nr, ort_name = parse_address(args.address)
+    requests = 0
+
+    orte, fetched = cached_get(region, "/orte", LIST_TTL, args.refresh)
+    requests += fetched
+    if ort_name:
+        ort = pick(orte, ort_name, "Ort")
+    elif len(orte) == 1:
+        ort = orte[0]
+    else:
+        print(json.dumps({"error": f"Region '{region}' has {len(orte)} Orte, add one after a comma: \"{street_name} {nr or ''}, Ort\"",
+                          "candidates": [{"id": o["id"], "name": o["name"]} for o in orte[:MAX_CANDIDATES]]}))
+        sys.exit(1)
+
+    strassen, fetched = cached_get(region, f"/orte/{ort['id']}/strassen", LIST_TTL, args.refresh)
+    requests += fetched
+    strasse = pick(strassen, street_name, "Straße")
+
+    # The strassen list carries house numbers only for its first entry, so ask for the street itself
+    detail, fetched = cached_get(region, f"/strassen/{strasse['id']}", LIST_TTL, args.refresh)
+    requests += fetched
+    hausnummern = (detail.get("hausNrList") or []) if isinstance(detail, dict) else []
+    hausnummer = None
+    if hausnummern:
+        if not nr:
+            print(json.dumps({"error": f"'{strasse['name']}' needs a house number",
+                              "hausnummern": [h["nr"] for h in hausnummern[:MAX_CANDIDATES]]}))
+            sys.exit(1)
+        hausnummer = next((h for h in hausnummern if normalize_nr(h["nr"]) == normalize_nr(nr)), None)
+        if not hausnummer:
+            print(json.dumps({"error": f"No house number '{nr}' in '{strasse['name']}'",
+                              "hausnummern": [h["nr"] for h in hausnummern[:MAX_CANDIDATES]]}))
+            sys.exit(1)
+        base = f"/hausnummern/{hausnummer['id']}"
+    else:
+        # Regions without house numbers schedule by street
+        base = f"/strassen/{strasse['id']}"
+
+    # Waste types of the address and its dates are independent once the region's
+    # fraktion IDs are known, so both requests go out at the same time
+    alle_fraktionen, fetched = cached_get(region, "/fraktionen", LIST_TTL, args.refresh)
+    requests += fetched
+    wanted = args.fraktion or [f["id"] for f in alle_fraktionen]
+    params = "&".join(f"fraktion={f}" for f in wanted)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+        f_fraktionen = pool.submit(cached_get, region, f"{base}/fraktionen", LIST_TTL, args.refresh)
+        f_termine = pool.submit(cached_get, region, f"{base}/termine?{params}", TERMINE_TTL, args.refresh)
+        fraktionen, fetched_f = f_fraktionen.result()
+        termine, fetched_t = f_termine.result()
+    requests += fetched_f + fetched_t
+
+    names = {f["id"]: f["name"] for f in fraktionen or alle_fraktionen}
+    since = args.since or datetime.date.today().isoformat()
+    dates = sorted(
+        ({"datum": t["datum"], "fraktionId": t["bezirk"]["fraktionId"], "fraktion": names.get(t["bezirk"]["fraktionId"])}
+         for t in termine
+         if t.get("datum", "") >= since and t.get("bezirk", {}).get("fraktionId") in names),
+        key=lambda t: (t["datum"], t["fraktionId"]),
+    )
+    print(json.dumps({
+        "region": region,
+        "ort": {"id": ort["id"], "name": ort["name"]},
+        "strasse": {"id": strasse["id"], "name": strasse["name"]},
+        "hausnummer": {"id": hausnummer["id"], "nr": hausnummer["nr"]} if hausnummer else None,
+        "fraktionen": [{"id": f["id"], "name": f["name"]} for f in fraktionen],
+        "termine": dates,
+        "_requests": requests,
+    }))
+
+
+def error_text(e):
+    if isinstance(e, urllib.error.HTTPError):
+        return f"HTTP {e.code}"
+    return str(getattr(e, "reason", e))
+
+
+def street_grams(norm):
+    # Padding lets the first and last letters carry weight in the similarity
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def crawl_streets(regions, workers, refresh=False):
+    """orte and strassen of every region, fetched in parallel with at most HOST_CONCURRENCY requests per host.
+
+    Every region gets its own small executor, so a region with many orte cannot hold
+    the workers of the others; `workers` caps the requests running across all hosts.
+    Returns ([(region, ort, strassen)], errors). Responses go through the lookup cache.
+    """
+    limit = threading.Semaphore(workers)
+
+    def get(region, path):
+        with limit:
+            return cached_get(region, path, LIST_TTL, refresh, getter=fetch_json)[0]
+
+    hosts = {region: concurrent.futures.ThreadPoolExecutor(max_workers=HOST_CONCURRENCY) for region in regions}
+    results, errors = [], []
+    try:
+        pending = {hosts[region].submit(get, region, "/orte"): (region, None) for region in regions}
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                region, ort = pending.pop(future)
+                try:
+                    data = future.result()
+                except Exception as e:
+                    errors.append({"region": region, "ortId": ort and ort["id"], "error": error_text(e)})
+                    continue
+                if ort is None:
+                    for o in data:
+                        pending[hosts[region].submit(get, region, f"/orte/{o['id']}/strassen")] = (region, o)
+                else:
+                    results.append((region, ort, data))
+    finally:
+        for pool in hosts.values():
+            pool.shutdown(cancel_futures=True)
+    return results, errors
+
+
+def build_street_index(args):
+    started = time.monotonic()
+    results, errors = crawl_streets(REGIONS, args.workers, args.refresh)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = STREET_INDEX.with_suffix(".tmp")
+    tmp.unlink(missing_ok=True)
+    con = sqlite3.connect(tmp)
+    con.execute("PRAGMA journal_mode = OFF")
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute("CREATE TABLE ort (id INTEGER PRIMARY KEY, region TEXT, ort_id INTEGER, name TEXT)")
+    con.execute("CREATE TABLE strasse (id INTEGER PRIMARY KEY, norm TEXT, name TEXT, ort INTEGER, "
+                "strasse_id INTEGER, grams INTEGER)")
+    con.execute("CREATE TABLE gram (gram TEXT, strasse INTEGER, PRIMARY KEY (gram, strasse)) WITHOUT ROWID")
+    con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    count = 0
+    for ort_row, (region, ort, strassen) in enumerate(sorted(results, key=lambda r: (r[0], r[1]["name"])), 1):
+        con.execute("INSERT INTO ort VALUES (?, ?, ?, ?)", (ort_row, region, ort["id"], ort["name"]))
+        for strasse in strassen:
+            count += 1
+            norm = normalize_name(strasse["name"])
+            grams = street_grams(norm)
+            con.execute("INSERT INTO strasse VALUES (?, ?, ?, ?, ?, ?)",
+                        (count, norm, strasse["name"], ort_row, strasse["id"], len(grams)))
+            con.executemany("INSERT INTO gram VALUES (?, ?)", ((g, count) for g in grams))
+    con.execute("CREATE INDEX strasse_norm ON strasse (norm)")
+    built = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    con.executemany("INSERT INTO meta VALUES (?, ?)",
+                    [("strassen", str(count)), ("orte", str(len(results))), ("built", built)])
+    con.commit()
+    con.close()
+    os.replace(tmp, STREET_INDEX)
+    print(json.dumps({"path": str(STREET_INDEX), "regionen": len({r[0] for r in results}), "orte": len(results),
+                      "strassen": count, "built": built, "errors": errors,
+                      "seconds": round(time.monotonic() - started, 1)}))
+
+
+def open_street_index():
+    if not STREET_INDEX.exists():
+        print(json.dumps({"error": "No street index. Run 'index build' first."}))
+        sys.exit(1)
+    return sqlite3.connect(f"file:{STREET_INDEX}?mode=ro", uri=True)
+
+
+def cmd_index(args):
+    if args.action == "build":
+        build_street_index(args)
+        return
+    con = open_street_index()
+    meta = dict(con.execute("SELECT key, value FROM meta"))
+    print(json.dumps({"path": str(STREET_INDEX), "orte": int(meta.get("orte", 0)),
+                      "strassen": int(meta.get("strassen", 0)), "built": meta.get("built")}))
+
+
+def cmd_strassensuche(args):
+    """Streets across all regions: exact matches after normalisation first, then trigram-similar names."""
+    started = time.monotonic()
+    con = open_street_index()
+    norm = normalize_name(args.name)
+    grams = street_grams(norm)
+    region_filter = ""
+    params = []
+    if args.regions:
+        region_filter = f" AND o.region IN ({','.join('?' * len(args.regions))})"
+        params = list(args.regions)
+    select = "SELECT o.region, o.ort_id, o.name, s.strasse_id, s.name, s.norm, s.grams"
+    rows = con.execute(f"{select} FROM strasse s JOIN ort o ON o.id = s.ort WHERE s.norm = ?{region_filter}",
+                       [norm] + params).fetchall()
+    scored = [(1.0, row) for row in rows]
+    if not args.exact and grams:
+        # Dice coefficient on trigrams; a name needs at least this many shared trigrams to reach FUZZY_MIN
+        min_shared = math.ceil(FUZZY_MIN * len(grams) / (2 - FUZZY_MIN))
+        marks = ",".join("?" * len(grams))
+        fuzzy = con.execute(
+            f"{select}, g.shared FROM strasse s JOIN ort o ON o.id = s.ort "
+            f"JOIN (SELECT strasse, COUNT(*) AS shared FROM gram WHERE gram IN ({marks}) "
+            f"GROUP BY strasse HAVING shared >= ?) g ON g.strasse = s.id WHERE s.norm != ?{region_filter}",
+            list(grams) + [min_shared, norm] + params)
+        for row in fuzzy:
+            score = 2 * row[7] / (len(grams) + row[6])
+            if score >= FUZZY_MIN:
+                scored.append((score, row))
+    scored.sort(key=lambda sr: (-sr[0], sr[1][4], sr[1][0], sr[1][2]))
+    hits = [{"region": r[0], "ortId": r[1], "ort": r[2], "strassenId": r[3], "name": r[4], "score": round(score, 3)}
+            for score, r in scored[:args.limit]]
+    out = {"query": args.name, "strassen": hits}
+    if len(scored) > args.limit:
+        out["_total"] = len(scored)
+        out["_showing"] = args.limit
+    out["_ms"] = round((time.monotonic() - started) * 1000, 1)
+    print(json.dumps(out))
+
+
+def retrying_get(region, path, getter=fetch_json):
+    """getter with up to RETRIES retries on connection errors and 429/5xx, backing off exponentially."""
+    for attempt in range(RETRIES + 1):
+        try:
+            return getter(region, path)
+        except urllib.error.HTTPError as e:
+            if e.code not in TRANSIENT_STATUS or attempt == RETRIES:
+                raise
+            retry_after = e.headers.get("Retry-After", "") if e.headers else ""
+            delay = float(retry_after) if retry_after.isdigit() else 0.5 * 2 ** attempt
+        except (OSError, http.client.HTTPException):
+            # HTTPException: a body cut short (IncompleteRead) comes out of resp.read(), not urlopen
+            if attempt == RETRIES:
+                raise
+            delay = 0.5 * 2 ** attempt
+        time.sleep(delay + random.uniform(0, delay / 2))
+
+
+def read_bulk_rows(path, default_region):
+    """CSV rows with region (optional), hausnummern_id or strassen_id, and fraktion IDs (optional, space/; separated).
+
+    Yields (line, row, region, path, fraktionen, error); error is set for rows that can't be requested.
+    """
+    f = sys.stdin if path == "-" else open(path, "r", newline="", encoding="utf-8-sig")
+    with f:
+        for line, row in enumerate(csv.DictReader(f), 2):
+            row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+            region = row.get("region") or default_region
+            path_, fraktionen, error = None, [], None
+            try:
+                fraktionen = [int(x) for x in re.split(r"[\s;|]+", row.get("fraktion", "")) if x]
+                if row.get("hausnummern_id"):
+                    path_ = f"/hausnummern/{int(row['hausnummern_id'])}"
+                elif row.get("strassen_id"):
+                    path_ = f"/strassen/{int(row['strassen_id'])}"
+                else:
+                    error = "hausnummern_id or strassen_id is required"
+            except ValueError as e:
+                error = f"Invalid ID: {e}"
+            yield line, row, region, path_, fraktionen, error
+
+
+def ics_escape(text):
+    return re.sub(r"([,;\\])", r"\\\1", str(text)).replace("\n", "\\n")
+
+
+def ics_line(line):
+    """A content line folded at 75 octets (RFC 5545 3.1), never inside a UTF-8 sequence."""
+    data = line.encode("utf-8")
+    parts, start, limit = [], 0, 75
+    while len(data) - start > limit:
+        end = start + limit
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end])
+        # Continuation lines start with a space, which counts against their 75 octets
+        start, limit = end, 74
+    parts.append(data[start:])
+    return b"\r\n ".join(parts).decode("utf-8") + "\r\n"
+
+
+def ics_events(row, region, termine):
+    key = row.get("key") or row.get("hausnummern_id") or row.get("strassen_id")
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    for t in termine:
+        day = t["datum"].replace("-", "")
+        yield "".join(ics_line(line) for line in (
+            "BEGIN:VEVENT",
+            f"UID:{region}-{key}-{t['fraktionId']}-{day}@abfallnavi",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{day}",
+            f"SUMMARY:{ics_escape(t['fraktion'] or t['fraktionId'])}",
+            f"CATEGORIES:{ics_escape(key)}",
+            "TRANSP:TRANSPARENT",
+            "END:VEVENT",
+        ))
+
+
+def cmd_bulk(args):
+    """Collection dates for every CSV row, with bounded concurrency per region host, streamed as they finish.
+
+    Rows are queued per region and every region gets its own executor, so the hosts
+    are worked on side by side even when the CSV is sorted by region.
+    """
+    started = time.monotonic()
+    limit = threading.Semaphore(args.workers)
+    region_fraktionen = {}
+    locks = {region: threading.Lock() for region in REGIONS}
+    since = args.since or datetime.date.today().isoformat()
+
+    def fraktion_names(region):
+        with locks[region]:
+            if region not in region_fraktionen:
+                data, _ = cached_get(region, "/fraktionen", LIST_TTL, getter=retrying_get)
+                region_fraktionen[region] = {f["id"]: f["name"] for f in data}
+            return region_fraktionen[region]
+
+    def fetch(region, path, fraktionen):
+        names = fraktion_names(region)
+        params = "&".join(f"fraktion={f}" for f in fraktionen or names)
+        with limit:
+            termine = retrying_get(region, f"{path}/termine?{params}")
+        return sorted(
+            ({"datum": t["datum"], "fraktionId": t["bezirk"]["fraktionId"], "fraktion": names.get(t["bezirk"]["fraktionId"])}
+             for t in termine if t.get("datum", "") >= since),
+            key=lambda t: (t["datum"], t["fraktionId"]),
+        )
+
+    done = errors = 0
+    last_report = started
+
+    def emit(line, row, region, termine=None, error=None):
+        nonlocal done, errors, last_report
+        done += 1
+        if error is not None:
+            errors += 1
+        if args.format == "ics":
+            if error is not None:
+                print(json.dumps({"line": line, "input": row, "error": error}), file=sys.stderr)
+            else:
+                sys.stdout.write("".join(ics_events(row, region, termine)))
+        else:
+            out = {"line": line, "input": row, "region": region}
+            out.update({"error": error} if error is not None else {"termine": termine})
+            sys.stdout.write(json.dumps(out, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_SECONDS:
+            last_report = now
+            print(json.dumps({"done": done, "errors": errors,
+                              "addresses_per_second": round(done / (now - started), 1)}), file=sys.stderr)
+
+    def collect(future, job):
+        line, row, region = job
+        try:
+            emit(line, row, region, termine=future.result())
+        except Exception as e:
+            emit(line, row, region, error=error_text(e))
+
+    if args.format == "ics":
+        sys.stdout.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//abfallnavi//bulk//DE\r\n")
+    queues = {}
+    for line, row, region, path, fraktionen, error in read_bulk_rows(args.csv, args.region):
+        if region not in REGIONS:
+            error = f"Unknown region '{region}'"
+        if error:
+            emit(line, row, region, error=error)
+            continue
+        queues.setdefault(region, collections.deque()).append((line, row, region, path, fraktionen))
+
+    hosts = {region: concurrent.futures.ThreadPoolExecutor(max_workers=args.per_host) for region in queues}
+    in_flight = dict.fromkeys(queues, 0)
+    pending = {}
+
+    def submit(region):
+        # A few jobs per host in flight, so 20k rows don't sit in memory as futures
+        queue = queues[region]
+        while queue and in_flight[region] < args.per_host * 2:
+            line, row, _, path, fraktionen = queue.popleft()
+            pending[hosts[region].submit(fetch, region, path, fraktionen)] = (line, row, region)
+            in_flight[region] += 1
+
+    try:
+        for region in queues:
+            submit(region)
+        while pending:
+            finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                job = pending.pop(future)
+                in_flight[job[2]] -= 1
+                collect(future, job)
+                submit(job[2])
+    finally:
+        for pool in hosts.values():
+            pool.shutdown(cancel_futures=True)
+    if args.format == "ics":
+        sys.stdout.write("END:VCALENDAR\r\n")
+        sys.stdout.flush()
+    elapsed = time.monotonic() - started
+    print(json.dumps({"addresses": done, "errors": errors, "seconds": round(elapsed, 1),
+                      "addresses_per_second": round(done / elapsed, 1) if elapsed else None}), file=sys.stderr)
+
+
 def cmd_orte(args):
     data = api_get(args.region, "/orte")
     print(json.dumps(data))
@@ -73,6 +574,14 @@ def cmd_termine(args):
     print(json.dumps(data))
 
 
+def positive_int(value):
+    """argparse type for --workers and --per-host: a whole number of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(description="Query Abfallnavi waste collection API")
     parser.add_argument(
@@ -99,6 +608,30 @@ def main():
     p_term.add_argument("--strassen-id", type=int, help="Street ID")
     p_term.add_argument("--fraktion", type=int, action="append", help="Waste type ID (repeatable)")
 
+    p_look = sub.add_parser("lookup", help="Collection dates for an address in one call")
+    p_look.add_argument("address", help='Address as "Straße Hausnummer, Ort" (Ort optional if the region has one)')
+    p_look.add_argument("--fraktion", type=int, action="append", help="Only these waste type IDs (repeatable, default: all)")
+    p_look.add_argument("--since", help="First date to include, YYYY-MM-DD (default: today)")
+    p_look.add_argument("--refresh", action="store_true", help="Ignore the local cache and fetch everything again")
+
+    p_idx = sub.add_parser("index", help="Local street index over all regions for 'strassensuche'")
+    p_idx.add_argument("action", choices=["build", "status"], help="build = crawl orte and strassen of every region")
+    p_idx.add_argument("--workers", type=positive_int, default=CRAWL_WORKERS, help=f"Parallel requests in total (default: {CRAWL_WORKERS}, at most {HOST_CONCURRENCY} per region)")
+    p_idx.add_argument("--refresh", action="store_true", help="Ignore cached orte/strassen lists while crawling")
+
+    p_such = sub.add_parser("strassensuche", help="Find a street in all regions via the local index")
+    p_such.add_argument("name", help="Street name; case, umlauts/ß and 'Str.' are normalised, typos tolerated")
+    p_such.add_argument("--regions", nargs="+", choices=REGIONS, metavar="REGION", help="Only these regions")
+    p_such.add_argument("--exact", action="store_true", help="Only exact matches after normalisation")
+    p_such.add_argument("--limit", type=int, default=SEARCH_LIMIT, help=f"Max results (default: {SEARCH_LIMIT})")
+
+    p_bulk = sub.add_parser("bulk", help="Collection dates for many addresses from a CSV, streamed")
+    p_bulk.add_argument("csv", help="CSV with columns hausnummern_id or strassen_id, optional region, fraktion, key ('-' = stdin)")
+    p_bulk.add_argument("--format", choices=["ndjson", "ics"], default="ndjson", help="Output format (default: ndjson)")
+    p_bulk.add_argument("--since", help="First date to include, YYYY-MM-DD (default: today)")
+    p_bulk.add_argument("--workers", type=positive_int, default=BULK_WORKERS, help=f"Parallel requests in total (default: {BULK_WORKERS})")
+    p_bulk.add_argument("--per-host", type=positive_int, default=BULK_PER_HOST, help=f"Parallel requests per region host (default: {BULK_PER_HOST})")
+
     args = parser.parse_args()
 
     commands = {
@@ -107,6 +640,10 @@ def main():
         "hausnummern": cmd_hausnummern,
         "fraktionen": cmd_fraktionen,
         "termine": cmd_termine,
+        "lookup": cmd_lookup,
+        "index": cmd_index,
+        "strassensuche": cmd_strassensuche,
+        "bulk": cmd_bulk,
     }
     commands[args.command](args)
 
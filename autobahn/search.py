@@ -2,21 +2,44 @@
 """Query the Autobahn API for German highway traffic information."""
 
 import argparse
+import concurrent.futures
 import json
+import math
+import os
+import pathlib
 import sys
+import tempfile
+import threading
+import time
+import urllib.parse
 import urllib.request
 import urllib.error
 
+import httpclient
+
 BASE_URL = "https://verkehr.autobahn.de/o/autobahn"
 
 SERVICES = ["roadworks", "webcam", "parking_lorry", "warning", "closure", "electric_charging_station"]
 
+CACHE_DIR = pathlib.Path(tempfile.gettempdir()) / "autobahn_cache"
+SNAPSHOT_PATH = CACHE_DIR / "snapshot.ndjson"
+GEO_INDEX_PATH = CACHE_DIR / "geo_index.json"
+
+GEO_SERVICES = ["electric_charging_station", "parking_lorry", "webcam", "warning"]
+GEO_MAX_AGE = 15 * 60
+GRID_DEG = 0.1
+NEAR_RADIUS_KM = 20
+MAX_ITEMS = 20
+
+SNAPSHOT_WORKERS = 16
+PER_HOST_LIMIT = 8
+
 
 def api_get(path):
     url = f"{BASE_URL}{path}"
     try:
         req = urllib.request.Request(url, headers={"Accept": "application/json"})
-        with urllib.request.urlopen(req, timeout=15) as resp:
+        with httpclient.urlopen(req, timeout=15) as resp:
             return json.loads(resp.read().decode("utf-8"))
     except urllib.error.HTTPError as e:
         print(json.dumps({"error": f"HTTP {e.code} for {url}"}))
@@ -26,6 +49,235 @@ def api_get(path):
         sys.exit(1)
 
 
+def fetch_json(path):
+    """GET without exiting on errors, for crawls that keep going. HTTP 204 yields None."""
+    req = urllib.request.Request(f"{BASE_URL}{path}", headers={"Accept": "application/json"})
+    with httpclient.urlopen(req, timeout=15) as resp:
+        raw = resp.read()
+    return json.loads(raw.decode("utf-8")) if raw.strip() else None
+
+
+class HostLimiter:
+    """Per-host politeness: at most `limit` requests in flight and `delay` seconds between starts."""
+
+    def __init__(self, limit, delay):
+        self.limit = limit
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def __call__(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = [threading.BoundedSemaphore(self.limit), 0.0]
+            state = self.hosts[host]
+        state[0].acquire()
+        if self.delay:
+            with self.lock:
+                start = max(time.monotonic(), state[1] + self.delay)
+                state[1] = start
+            time.sleep(max(0.0, start - time.monotonic()))
+        return state[0]
+
+
+def crawl_service(limiter, road, service):
+    path = f"/{urllib.parse.quote(road.strip(), safe='')}/services/{service}"
+    slot = limiter(f"{BASE_URL}{path}")
+    started = time.monotonic()
+    try:
+        data = fetch_json(path)
+    finally:
+        slot.release()
+    items = data.get(service, []) if isinstance(data, dict) else []
+    return items, time.monotonic() - started
+
+
+def cmd_snapshot(args):
+    crawl_started = time.monotonic()
+    roads = [r for r in api_get("/").get("roads", []) if r and r.strip()]
+    services = args.service or SERVICES
+    out = pathlib.Path(args.out) if args.out else SNAPSHOT_PATH
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + ".tmp")
+    limiter = HostLimiter(args.per_host, args.delay)
+    latencies, errors, by_service = [], [], dict.fromkeys(services, 0)
+    with open(tmp, "w") as f, concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(crawl_service, limiter, road, svc): (road.strip(), svc)
+                   for road in roads for svc in services}
+        for fut in concurrent.futures.as_completed(futures):
+            road, svc = futures[fut]
+            try:
+                items, seconds = fut.result()
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                reason = f"HTTP {e.code}" if isinstance(e, urllib.error.HTTPError) else str(getattr(e, "reason", e))
+                errors.append({"road": road, "service": svc, "error": reason})
+                continue
+            latencies.append(seconds)
+            by_service[svc] += len(items)
+            if items:
+                f.write(json.dumps({"road": road, "service": svc, "items": items}, separators=(",", ":")) + "\n")
+        latencies.sort()
+        stats = {
+            "roads": len(roads),
+            "requests": len(futures) + 1,
+            "items": sum(by_service.values()),
+            "by_service": by_service,
+            "errors": errors,
+            "seconds": round(time.monotonic() - crawl_started, 2),
+            "latency": {
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "p50": round(latencies[len(latencies) // 2], 3) if latencies else None,
+                "p95": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else None,
+                "max": round(latencies[-1], 3) if latencies else None,
+            },
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        f.write(json.dumps({"_stats": stats}) + "\n")
+    os.replace(tmp, out)
+    print(json.dumps(dict(stats, path=str(out))))
+
+
+def compact_item(road, service, item):
+    """Reduce a service item to what the geo queries return; None if it has no usable coordinate."""
+    coord = item.get("coordinate") or {}
+    try:
+        lat, lon = float(coord["lat"]), float(coord["long"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    out = {"service": service, "road": road, "lat": lat, "lon": lon}
+    for key in ("identifier", "title", "subtitle", "display_type", "imageurl", "linkurl"):
+        if item.get(key):
+            out[key] = item[key]
+    return out
+
+
+def load_geo_index():
+    try:
+        with open(GEO_INDEX_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"pairs": {}}
+
+
+def save_geo_index(index):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = GEO_INDEX_PATH.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp, GEO_INDEX_PATH)
+
+
+def cmd_index(args):
+    started = time.monotonic()
+    index = load_geo_index()
+    pairs = index["pairs"]
+    errors, refreshed = [], 0
+    if args.from_snapshot:
+        # Replace the index with the snapshot's contents, stamped with the snapshot's mtime
+        path = pathlib.Path(args.from_snapshot)
+        fetched = path.stat().st_mtime
+        pairs.clear()
+        with open(path, "r") as f:
+            for line in f:
+                row = json.loads(line)
+                if row.get("service") in GEO_SERVICES:
+                    items = [compact_item(row["road"], row["service"], i) for i in row.get("items", [])]
+                    pairs[f"{row['road']}|{row['service']}"] = {"fetched": fetched, "items": [i for i in items if i]}
+                    refreshed += 1
+    else:
+        roads = [r.strip() for r in api_get("/").get("roads", []) if r and r.strip()]
+        wanted = {f"{road}|{svc}" for road in roads for svc in GEO_SERVICES}
+        for key in pairs.keys() - wanted:
+            del pairs[key]
+        now = time.time()
+        stale = [key for key in sorted(wanted) if args.full or now - pairs.get(key, {}).get("fetched", 0) > args.max_age]
+        limiter = HostLimiter(args.per_host, 0.0)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = {pool.submit(crawl_service, limiter, *key.split("|")): key for key in stale}
+            for fut in concurrent.futures.as_completed(futures):
+                road, svc = futures[fut].split("|")
+                try:
+                    items, _ = fut.result()
+                except (urllib.error.URLError, OSError, ValueError) as e:
+                    reason = f"HTTP {e.code}" if isinstance(e, urllib.error.HTTPError) else str(getattr(e, "reason", e))
+                    errors.append({"road": road, "service": svc, "error": reason})
+                    continue
+                compact = [compact_item(road, svc, i) for i in items]
+                pairs[futures[fut]] = {"fetched": time.time(), "items": [i for i in compact if i]}
+                refreshed += 1
+    save_geo_index(index)
+    print(json.dumps({"path": str(GEO_INDEX_PATH), "pairs": len(pairs), "refreshed": refreshed,
+                      "items": sum(len(p["items"]) for p in pairs.values()), "errors": errors,
+                      "seconds": round(time.monotonic() - started, 2)}))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 12742.0 * math.asin(math.sqrt(min(1.0, a)))
+
+
+class GeoIndex:
+    """Grid buckets of GRID_DEG degrees over the indexed items, de-duplicated by identifier."""
+
+    def __init__(self, pairs, services):
+        self.cells = {}
+        seen = set()
+        for entry in pairs.values():
+            for item in entry["items"]:
+                key = (item["service"], item.get("identifier") or (item["lat"], item["lon"]))
+                if item["service"] not in services or key in seen:
+                    continue
+                seen.add(key)
+                cell = (math.floor(item["lat"] / GRID_DEG), math.floor(item["lon"] / GRID_DEG))
+                self.cells.setdefault(cell, []).append(item)
+
+    def bbox(self, lat1, lon1, lat2, lon2):
+        lat1, lat2 = sorted((lat1, lat2))
+        lon1, lon2 = sorted((lon1, lon2))
+        hits = []
+        for cy in range(math.floor(lat1 / GRID_DEG), math.floor(lat2 / GRID_DEG) + 1):
+            for cx in range(math.floor(lon1 / GRID_DEG), math.floor(lon2 / GRID_DEG) + 1):
+                hits.extend(i for i in self.cells.get((cy, cx), ())
+                            if lat1 <= i["lat"] <= lat2 and lon1 <= i["lon"] <= lon2)
+        return hits
+
+    def near(self, lat, lon, radius_km):
+        dlat = radius_km / 111.2
+        dlon = radius_km / (111.2 * max(0.01, math.cos(math.radians(lat))))
+        hits = []
+        for item in self.bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon):
+            dist = haversine_km(lat, lon, item["lat"], item["lon"])
+            if dist <= radius_km:
+                hits.append(dict(item, distance_km=round(dist, 2)))
+        return sorted(hits, key=lambda i: i["distance_km"])
+
+
+def open_geo_index(args):
+    if not GEO_INDEX_PATH.exists():
+        print(json.dumps({"error": "No geo index. Run 'index' (or 'index --from-snapshot FILE') first."}))
+        sys.exit(1)
+    return GeoIndex(load_geo_index()["pairs"], set(args.service or GEO_SERVICES))
+
+
+def print_items(items, limit):
+    out = {"items": items[:limit]}
+    if len(items) > limit:
+        out["_total"] = len(items)
+        out["_showing"] = limit
+    print(json.dumps(out))
+
+
+def cmd_near(args):
+    print_items(open_geo_index(args).near(args.lat, args.lon, args.radius), args.limit)
+
+
+def cmd_bbox(args):
+    print_items(open_geo_index(args).bbox(args.lat1, args.lon1, args.lat2, args.lon2), args.limit)
+
+
 def cmd_roads(args):
     print(json.dumps(api_get("/")))
 
@@ -40,6 +292,14 @@ def cmd_details(args):
     print(json.dumps(data))
 
 
+def positive_int(value):
+    """argparse type for --workers and --per-host: a whole number of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(description="Query German Autobahn traffic API")
     sub = parser.add_subparsers(dest="command", required=True)
@@ -54,12 +314,51 @@ def main():
     p_det.add_argument("service", choices=SERVICES, help="Service type")
     p_det.add_argument("item_id", help="Item ID (base64-encoded)")
 
+    p_snap = sub.add_parser("snapshot", help="Crawl all roads x services into one NDJSON file")
+    p_snap.add_argument("--out", help=f"Snapshot file (default: {SNAPSHOT_PATH})")
+    p_snap.add_argument("--service", action="append", choices=SERVICES, help="Only this service (repeatable)")
+    p_snap.add_argument("--workers", type=positive_int, default=SNAPSHOT_WORKERS,
+                        help=f"Worker threads (default: {SNAPSHOT_WORKERS})")
+    p_snap.add_argument("--per-host", type=positive_int, default=PER_HOST_LIMIT,
+                        help=f"Max concurrent requests per host (default: {PER_HOST_LIMIT})")
+    p_snap.add_argument("--delay", type=float, default=0.0, help="Min seconds between request starts per host")
+
+    p_idx = sub.add_parser("index", help="Build/refresh the local geo index of charging, parking, webcam and warning items")
+    p_idx.add_argument("--max-age", type=int, default=GEO_MAX_AGE,
+                       help=f"Refetch road/service pairs older than this many seconds (default: {GEO_MAX_AGE})")
+    p_idx.add_argument("--full", action="store_true", help="Refetch all pairs")
+    p_idx.add_argument("--from-snapshot", metavar="FILE", help="Build from a 'snapshot' file instead of the API")
+    p_idx.add_argument("--workers", type=positive_int, default=SNAPSHOT_WORKERS,
+                       help=f"Worker threads (default: {SNAPSHOT_WORKERS})")
+    p_idx.add_argument("--per-host", type=positive_int, default=PER_HOST_LIMIT,
+                       help=f"Max concurrent requests per host (default: {PER_HOST_LIMIT})")
+
+    p_near = sub.add_parser("near", help="Indexed items within a radius of a point")
+    p_near.add_argument("lat", type=float, help="Latitude")
+    p_near.add_argument("lon", type=float, help="Longitude")
+    p_near.add_argument("--radius", type=float, default=NEAR_RADIUS_KM,
+                        help=f"Radius in km (default: {NEAR_RADIUS_KM})")
+
+    p_bbox = sub.add_parser("bbox", help="Indexed items inside a bounding box")
+    p_bbox.add_argument("lat1", type=float, help="Latitude of one corner")
+    p_bbox.add_argument("lon1", type=float, help="Longitude of one corner")
+    p_bbox.add_argument("lat2", type=float, help="Latitude of the opposite corner")
+    p_bbox.add_argument("lon2", type=float, help="Longitude of the opposite corner")
+
+    for p in (p_near, p_bbox):
+        p.add_argument("--service", action="append", choices=GEO_SERVICES, help="Only this service (repeatable)")
+        p.add_argument("--limit", type=int, default=MAX_ITEMS, help=f"Max items (default: {MAX_ITEMS})")
+
     args = parser.parse_args()
 
     commands = {
         "roads": cmd_roads,
         "services": cmd_services,
         "details": cmd_details,
+        "snapshot": cmd_snapshot,
+        "index": cmd_index,
+        "near": cmd_near,
+        "bbox": cmd_bbox,
     }
     commands[args.command](args)
 
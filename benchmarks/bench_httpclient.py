@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Compare urllib.request.urlopen with the pooled httpclient.urlopen.
+
+Starts a local HTTPS stand-in for the APIs (self-signed certificate made with
+the openssl CLI, HTTP/1.1 keep-alive) and sends the same GET requests with
+both clients, once sequentially and once on a thread pool. --connect-delay
+adds a pause to every new connection to stand in for the network round trips
+of a real TCP/TLS handshake. Reports requests per second and how many
+connections the server accepted.
+
+    python3 benchmarks/bench_httpclient.py [--requests N] [--workers N] [--connect-delay S]
+"""
+
+import argparse
+import concurrent.futures
+import http.server
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPO_DIR, "shared"))
+
+import httpclient  # noqa: E402
+
+BODY = json.dumps({"items": [{"id": i, "name": f"Station {i}"} for i in range(50)]}).encode()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle every keep-alive response would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Handshake here rather than in accept(), so new connections are set up in parallel
+        self.request.do_handshake()
+        super().setup()
+        self.server.connections += 1
+        time.sleep(self.server.connect_delay)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_certificate(tmp):
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+def start_server(cert, key, connect_delay):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.connect_delay = connect_delay
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(server, fetch, requests, workers):
+    url = f"https://localhost:{server.server_address[1]}/data.json"
+    server.connections = 0
+    start = time.perf_counter()
+    if workers == 1:
+        for _ in range(requests):
+            fetch(url)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(fetch, [url] * requests))
+    elapsed = time.perf_counter() - start
+    return {"seconds": round(elapsed, 3), "requests_per_second": round(requests / elapsed, 1),
+            "connections": server.connections}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep-alive pool vs. urllib benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per run (default: 200)")
+    parser.add_argument("--workers", type=int, default=8, help="Threads for the concurrent runs (default: 8)")
+    parser.add_argument("--connect-delay", type=float, default=0.02,
+                        help="Seconds added to every new connection (default: 0.02)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_certificate(tmp)
+        server = start_server(cert, key, args.connect_delay)
+        context = ssl.create_default_context(cafile=cert)
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), urllib.request.HTTPSHandler(context=context))
+        pool = httpclient.ConnectionPool(max_idle=args.workers, context=context)
+        pool.proxies = {}
+
+        def fetch_urllib(url):
+            with opener.open(url, timeout=15) as resp:
+                return resp.read()
+
+        def fetch_pooled(url):
+            with pool.urlopen(url, timeout=15) as resp:
+                return resp.read()
+
+        results = {}
+        for name, fetch in (("urllib", fetch_urllib), ("httpclient", fetch_pooled)):
+            for mode, workers in (("sequential", 1), ("concurrent", args.workers)):
+                results[f"{name}_{mode}"] = run(server, fetch, args.requests, workers)
+            pool.close()
+        server.shutdown()
+
+    for mode in ("sequential", "concurrent"):
+        base, pooled = results[f"urllib_{mode}"], results[f"httpclient_{mode}"]
+        results[f"speedup_{mode}"] = round(pooled["requests_per_second"] / base["requests_per_second"], 2)
+    print(json.dumps(dict(results, requests=args.requests, workers=args.workers,
+                          connect_delay=args.connect_delay), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,25 @@
 """Query the DWD (Deutscher Wetterdienst) API for weather data and warnings."""
 
 import argparse
+import codecs
+import concurrent.futures
+import contextlib
 import gzip
+import io
 import json
+import math
+import os
+import pathlib
+import sqlite3
 import sys
+import tempfile
+import time
 import urllib.request
 import urllib.error
 import urllib.parse
 
+import httpclient
+
 BASE_FORECAST = "https://app-prod-ws.warnwetter.de/v30"
 BASE_STATIC = "https://s3.eu-central-1.amazonaws.com/app-prod-static.warnwetter.de/v16"
 
@@ -24,17 +36,29 @@ WARNING_PATHS = {
     "lawine": "/warnings_lawine.json",
 }
 
+REGION_KEYED = {"gemeinde", "gemeinde_en"}
+NON_REGION_KEYS = ("warnings", "_total", "_showing", "_hint", "time", "binnenSee")
+
+CACHE_DIR = pathlib.Path(tempfile.gettempdir()) / "dwd_cache"
+CHUNK_SIZE = 1 << 16
+GRID_DEG = 0.25
+
 MAX_ITEMS = 10
+FORECAST_CHUNK = 25
+FORECAST_WORKERS = 8
+
+
+def decode_body(raw):
+    if raw[:2] == b"\x1f\x8b":
+        raw = gzip.decompress(raw)
+    return raw.decode("utf-8")
 
 
 def api_get(url):
     try:
         req = urllib.request.Request(url, headers={"Accept": "application/json"})
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            raw = resp.read()
-            if raw[:2] == b"\x1f\x8b":
-                raw = gzip.decompress(raw)
-            data = raw.decode("utf-8")
+        with httpclient.urlopen(req, timeout=30) as resp:
+            data = decode_body(resp.read())
             try:
                 return json.loads(data)
             except json.JSONDecodeError:
@@ -47,6 +71,34 @@ def api_get(url):
         sys.exit(1)
 
 
+def api_get_conditional(url, validators):
+    """Like api_get, but sends the cached ETag/Last-Modified and returns (None, validators) on 304."""
+    headers = {"Accept": "application/json"}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("lastModified"):
+        headers["If-Modified-Since"] = validators["lastModified"]
+    try:
+        req = urllib.request.Request(url, headers=headers)
+        with httpclient.urlopen(req, timeout=30) as resp:
+            raw = resp.read()
+            fresh = {"etag": resp.headers.get("ETag") or "", "lastModified": resp.headers.get("Last-Modified") or ""}
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, validators
+        print(json.dumps({"error": f"HTTP {e.code} for {url}"}))
+        sys.exit(1)
+    except urllib.error.URLError as e:
+        print(json.dumps({"error": f"Connection failed: {e.reason}"}))
+        sys.exit(1)
+    try:
+        return json.loads(decode_body(raw)), fresh
+    except (ValueError, OSError, EOFError) as e:
+        # Malformed JSON, text or gzip body: report it instead of caching it
+        print(json.dumps({"error": f"Invalid JSON from {url}: {e}"}))
+        sys.exit(1)
+
+
 def strip_bulk(items):
     """Remove large geometry and HTML data to keep output manageable."""
     for w in items:
@@ -60,31 +112,257 @@ def strip_bulk(items):
     return items
 
 
+FORECAST_DROP_FIELDS = {"icon1h", "cloudCoverTotal", "temperatureStd", "surfacePressure",
+                        "dewPoint2m", "isDay"}
+
+
+def trim_station(station):
+    """Strip verbose fields, keep only forecast1 trimmed to 24h and 5 days."""
+    station.pop("forecast2", None)
+    fc = station.get("forecast1")
+    if isinstance(fc, dict):
+        for d in FORECAST_DROP_FIELDS:
+            fc.pop(d, None)
+        for k in list(fc.keys()):
+            v = fc[k]
+            if isinstance(v, list) and len(v) > 24:
+                fc[k] = v[:24]
+    if "days" in station and isinstance(station["days"], list):
+        station["days"] = station["days"][:5]
+
+
+def fetch_forecast_chunk(ids):
+    started = time.monotonic()
+    data = api_get(f"{BASE_FORECAST}/stationOverviewExtended?stationIds={','.join(ids)}")
+    for station in data.values():
+        if isinstance(station, dict):
+            trim_station(station)
+    return data, time.monotonic() - started
+
+
+def read_station_ids(args):
+    ids = args.station_ids.split(",") if args.station_ids else []
+    if args.file:
+        f = sys.stdin if args.file == "-" else open(args.file, "r")
+        with f:
+            for line in f:
+                line = line.split("#", 1)[0]
+                ids.extend(line.replace(",", " ").split())
+    # De-duplicate while keeping the caller's order
+    return list(dict.fromkeys(i.strip() for i in ids if i.strip()))
+
+
+def positive_int(value):
+    """argparse type for --workers and --chunk-size: a whole number of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
 def cmd_forecast(args):
-    ids = args.station_ids
-    url = f"{BASE_FORECAST}/stationOverviewExtended?stationIds={ids}"
-    data = api_get(url)
-    # Strip verbose fields, keep only forecast1 trimmed to 24h
-    drop_fields = {"icon1h", "cloudCoverTotal", "temperatureStd", "surfacePressure",
-                   "dewPoint2m", "isDay"}
-    for station_id, station in data.items():
-        if not isinstance(station, dict):
-            continue
-        station.pop("forecast2", None)
-        fc = station.get("forecast1")
-        if isinstance(fc, dict):
-            for d in drop_fields:
-                fc.pop(d, None)
-            for k in list(fc.keys()):
-                v = fc[k]
-                if isinstance(v, list) and len(v) > 24:
-                    fc[k] = v[:24]
-        if "days" in station and isinstance(station["days"], list):
-            station["days"] = station["days"][:5]
+    ids = read_station_ids(args)
+    if not ids:
+        print(json.dumps({"error": "Provide STATION_IDS or --file"}))
+        sys.exit(1)
+    size = args.chunk_size
+    chunks = [ids[i:i + size] for i in range(0, len(ids), size)]
+    merged, timings = {}, []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(args.workers, len(chunks))) as pool:
+        futures = {pool.submit(fetch_forecast_chunk, chunk): n for n, chunk in enumerate(chunks)}
+        for fut in concurrent.futures.as_completed(futures):
+            data, seconds = fut.result()
+            merged.update(data)
+            timings.append({"chunk": futures[fut], "stations": len(chunks[futures[fut]]),
+                            "seconds": round(seconds, 3)})
+    # Same shape and order as a single stationOverviewExtended request
+    data = {i: merged.pop(i) for i in ids if i in merged}
+    data.update(merged)
+    if len(chunks) > 1:
+        data["_chunks"] = sorted(timings, key=lambda t: t["chunk"])
+    print(json.dumps(data))
+
+
+class JSONStream:
+    """Pull parser that walks a large JSON document key by key from a byte stream."""
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf, self.pos, self.eof = "", 0, False
+
+    def _fill(self):
+        if self.eof:
+            raise ValueError("Unexpected end of JSON document")
+        # Read at least as much as is pending so retries on a large value stay linear
+        chunk = self.stream.read(max(self.chunk_size, len(self.buf) - self.pos))
+        self.eof = not chunk
+        self.buf, self.pos = self.buf[self.pos:] + self.utf8.decode(chunk, final=self.eof), 0
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self._fill()
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError(f"Expected '{ch}' in JSON document")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next value; returns (value, its JSON source text)."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    text, self.pos = self.buf[self.pos:end], end
+                    return value, text
+            except json.JSONDecodeError:
+                pass
+            self._fill()
+
+    def keys(self):
+        """Yield the keys of the object at the cursor. Each value must be consumed before the next key."""
+        self.expect("{")
+        while True:
+            ch = self.peek()
+            if ch == "}":
+                self.pos += 1
+                return
+            if ch == ",":
+                self.pos += 1
+                continue
+            key, _ = self.value()
+            self.expect(":")
+            yield key
+
+
+def region_rows(stream, section):
+    for ars in stream.keys():
+        _, text = stream.value()
+        yield ars, section, text
+
+
+def deferred_rows(sections):
+    """region_rows of sections that were kept as source text."""
+    for section, raw in sections:
+        yield from region_rows(JSONStream(io.BytesIO(raw.encode("utf-8"))), section)
+
+
+def region_index(kind):
+    """Return a SQLite index of region-keyed warnings, rebuilt only when upstream `time` changes.
+
+    The document is revalidated with If-None-Match/If-Modified-Since and parsed as a
+    stream; region values are stored as their JSON source text without re-encoding.
+    Parsing stops as soon as `time` matches the cached index. Sections that come
+    before `time` are kept as text and split into rows once `time` turned out to differ.
+    """
+    path = CACHE_DIR / f"{kind}.sqlite"
+    meta = {}
+    if path.exists():
+        with contextlib.closing(sqlite3.connect(path)) as con:
+            meta = dict(con.execute("SELECT key, value FROM meta"))
+    url = f"{BASE_STATIC}{WARNING_PATHS[kind]}"
+    headers = {"Accept": "application/json"}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("lastModified"):
+        headers["If-Modified-Since"] = meta["lastModified"]
+    try:
+        req = urllib.request.Request(url, headers=headers)
+        resp = httpclient.urlopen(req, timeout=30)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and meta:
+            return path
+        print(json.dumps({"error": f"HTTP {e.code} for {url}"}))
+        sys.exit(1)
+    except urllib.error.URLError as e:
+        print(json.dumps({"error": f"Connection failed: {e.reason}"}))
+        sys.exit(1)
+    insert = "INSERT OR REPLACE INTO region VALUES (?, ?, ?)"
+    with resp:
+        validators = {"etag": resp.headers.get("ETag") or "", "lastModified": resp.headers.get("Last-Modified") or ""}
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.unlink(missing_ok=True)
+        con = sqlite3.connect(tmp)
+        try:
+            body = gzip.GzipFile(fileobj=resp) if resp.peek(2)[:2] == b"\x1f\x8b" else resp
+            stream = JSONStream(body)
+            con.execute("CREATE TABLE region (ars TEXT, section TEXT, value TEXT, PRIMARY KEY (ars, section))")
+            con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            # Sections seen before `time`, kept as source text until we know the index is stale
+            deferred = [] if meta.get("time") else None
+            for key in stream.keys():
+                if key == "time":
+                    _, text = stream.value()
+                    if meta.get("time") == text:
+                        # Same issue as the cached index: keep it, just remember the new validators
+                        con.close()
+                        tmp.unlink()
+                        with contextlib.closing(sqlite3.connect(path)) as old:
+                            old.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", validators.items())
+                            old.commit()
+                        return path
+                    con.execute("INSERT INTO meta VALUES ('time', ?)", (text,))
+                    con.executemany(insert, deferred_rows(deferred or []))
+                    deferred = None
+                elif key not in NON_REGION_KEYS and stream.peek() == "{":
+                    if deferred is not None:
+                        # One C-level decode of the section, no per-region work until needed
+                        deferred.append((key, stream.value()[1]))
+                    else:
+                        con.executemany(insert, region_rows(stream, key))
+                else:
+                    stream.value()
+            con.executemany(insert, deferred_rows(deferred or []))
+            con.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", validators.items())
+            con.commit()
+        except (urllib.error.URLError, OSError, EOFError, ValueError) as e:
+            # Never leave a half-built index behind
+            con.close()
+            tmp.unlink(missing_ok=True)
+            reason = f"Invalid JSON from {url}: {e}" if isinstance(e, ValueError) else f"Connection failed: {getattr(e, 'reason', e)}"
+            print(json.dumps({"error": reason}))
+            sys.exit(1)
+        con.close()
+    os.replace(tmp, path)
+    return path
+
+
+def cmd_region_warnings(args):
+    if args.type not in REGION_KEYED:
+        print(json.dumps({"error": f"--region is only supported for {', '.join(sorted(REGION_KEYED))}"}))
+        sys.exit(1)
+    wanted = list(dict.fromkeys(args.region))
+    with contextlib.closing(sqlite3.connect(region_index(args.type))) as con:
+        upstream = con.execute("SELECT value FROM meta WHERE key = 'time'").fetchone()
+        marks = ",".join("?" * len(wanted))
+        rows = con.execute(f"SELECT section, ars, value FROM region WHERE ars IN ({marks})", wanted).fetchall()
+    data = {"time": json.loads(upstream[0]) if upstream else None}
+    found = set()
+    for section, ars, value in rows:
+        data.setdefault(section, {})[ars] = json.loads(value)
+        found.add(ars)
+    missing = [a for a in wanted if a not in found]
+    if missing:
+        data["_no_warnings"] = missing
     print(json.dumps(data))
 
 
 def cmd_warnings(args):
+    if args.region:
+        cmd_region_warnings(args)
+        return
+    if args.at or args.points:
+        cmd_warnings_at(args)
+        return
     path = WARNING_PATHS[args.type]
     url = f"{BASE_STATIC}{path}"
     data = api_get(url)
@@ -101,7 +379,7 @@ def cmd_warnings(args):
         # binnenSee / gemeinde keyed by region code
         for key in list(data.keys()):
             val = data[key]
-            if isinstance(val, dict) and key not in ("warnings", "_total", "_showing", "_hint", "time", "binnenSee"):
+            if isinstance(val, dict) and key not in NON_REGION_KEYS:
                 # gemeinde format: {"091620000000": [{...}], ...}
                 total_keys = len(val)
                 if total_keys > limit:
@@ -112,6 +390,123 @@ def cmd_warnings(args):
     print(json.dumps(data))
 
 
+def region_rings(region):
+    """Yield the outer rings of a warning region as flat [lon, lat, lon, lat, ...] lists."""
+    geom = region.get("polygonGeometry")
+    if isinstance(geom, dict) and geom.get("coordinates"):
+        polys = geom["coordinates"] if geom.get("type") == "MultiPolygon" else [geom["coordinates"]]
+        for poly in polys:
+            if poly and len(poly[0]) >= 3:
+                yield [c for pt in poly[0] for c in pt[:2]]
+        return
+    flat = region.get("polygon")
+    if not isinstance(flat, list) or len(flat) < 6:
+        return
+    if isinstance(flat[0], list):
+        flat = [c for pt in flat for c in pt[:2]]
+    # DWD ships lat/lon pairs; within Germany latitude (47-55) is always larger than longitude (5-15)
+    if flat[0] > flat[1]:
+        flat = [c for i in range(0, len(flat) - 1, 2) for c in (flat[i + 1], flat[i])]
+    yield flat
+
+
+def point_in_ring(x, y, ring):
+    """Even-odd ray casting test against a flat [x0, y0, x1, y1, ...] ring."""
+    inside = False
+    n = len(ring)
+    x1, y1 = ring[n - 2], ring[n - 1]
+    for i in range(0, n, 2):
+        x2, y2 = ring[i], ring[i + 1]
+        if (y2 > y) != (y1 > y) and x < (x1 - x2) * (y - y2) / (y1 - y2) + x2:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+class WarningGrid:
+    """Uniform grid over polygon bounding boxes; exact ring test as the second step."""
+
+    def __init__(self, polygons):
+        self.polygons = []
+        self.cells = {}
+        for warning, ring in polygons:
+            xs, ys = ring[0::2], ring[1::2]
+            bbox = (min(xs), min(ys), max(xs), max(ys))
+            pid = len(self.polygons)
+            self.polygons.append((warning, bbox, ring))
+            for cx in range(math.floor(bbox[0] / GRID_DEG), math.floor(bbox[2] / GRID_DEG) + 1):
+                for cy in range(math.floor(bbox[1] / GRID_DEG), math.floor(bbox[3] / GRID_DEG) + 1):
+                    self.cells.setdefault((cx, cy), []).append(pid)
+
+    def query(self, lat, lon):
+        """Indices of the warnings whose geometry contains the point."""
+        hits = set()
+        for pid in self.cells.get((math.floor(lon / GRID_DEG), math.floor(lat / GRID_DEG)), ()):
+            warning, (x0, y0, x1, y1), ring = self.polygons[pid]
+            if warning in hits or not (x0 <= lon <= x1 and y0 <= lat <= y1):
+                continue
+            if point_in_ring(lon, lat, ring):
+                hits.add(warning)
+        return sorted(hits)
+
+
+def geo_index(kind):
+    """Load the warning geometry for one `time` stamp, rebuilding it only when upstream changes."""
+    path = CACHE_DIR / f"{kind}_geo.json"
+    try:
+        with open(path, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    data, validators = api_get_conditional(f"{BASE_STATIC}{WARNING_PATHS[kind]}", cache)
+    if data is None:
+        return cache, WarningGrid(cache["polygons"])
+    warnings = data.get("warnings") if isinstance(data, dict) else None
+    if not isinstance(warnings, list):
+        print(json.dumps({"error": f"Warning type '{kind}' has no warning geometry"}))
+        sys.exit(1)
+    if "polygons" not in cache or data.get("time") != cache.get("time"):
+        polygons = [[i, ring] for i, w in enumerate(warnings)
+                    for r in w.get("regions") or [] for ring in region_rings(r)]
+        cache = {"time": data.get("time"), "warnings": strip_bulk(warnings), "polygons": polygons}
+    cache.update(validators)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+    return cache, WarningGrid(cache["polygons"])
+
+
+def read_points(args):
+    points = [tuple(args.at)] if args.at else []
+    if args.points:
+        f = sys.stdin if args.points == "-" else open(args.points, "r")
+        with f:
+            for line in f:
+                parts = line.split("#", 1)[0].replace(",", " ").split()
+                if len(parts) >= 2:
+                    points.append((float(parts[0]), float(parts[1])))
+    return points
+
+
+def cmd_warnings_at(args):
+    points = read_points(args)
+    cache, grid = geo_index(args.type)
+    warnings = cache["warnings"]
+    if len(points) == 1 and not args.points:
+        lat, lon = points[0]
+        print(json.dumps({"time": cache.get("time"), "lat": lat, "lon": lon,
+                          "warnings": [warnings[i] for i in grid.query(lat, lon)]}))
+        return
+    started = time.monotonic()
+    results = [{"lat": lat, "lon": lon, "warnings": grid.query(lat, lon)} for lat, lon in points]
+    elapsed = time.monotonic() - started
+    used = sorted({i for r in results for i in r["warnings"]})
+    print(json.dumps({"time": cache.get("time"), "warnings": {i: warnings[i] for i in used},
+                      "points": results, "_query_seconds": round(elapsed, 4)}))
+
+
 STRIP_KEYS = {"imageUrl", "imageThumbUrl", "imageMediumUrl", "blurHash",
                "imageThumbWidth", "imageThumbHeight", "zusatzAttribute",
                "instructionHtml", "descriptionHtml"}
@@ -142,10 +537,20 @@ def main():
     sub = parser.add_subparsers(dest="command", required=True)
 
     p_fc = sub.add_parser("forecast", help="Weather forecast for stations")
-    p_fc.add_argument("station_ids", help="Station ID(s), comma-separated (e.g. 10865,10382)")
+    p_fc.add_argument("station_ids", nargs="?", help="Station ID(s), comma-separated (e.g. 10865,10382)")
+    p_fc.add_argument("--file", help="Station list file, one or more IDs per line ('-' for stdin)")
+    p_fc.add_argument("--chunk-size", type=positive_int, default=FORECAST_CHUNK,
+                      help=f"Stations per request (default: {FORECAST_CHUNK})")
+    p_fc.add_argument("--workers", type=positive_int, default=FORECAST_WORKERS,
+                      help=f"Concurrent requests (default: {FORECAST_WORKERS})")
 
     p_warn = sub.add_parser("warnings", help="Current weather warnings")
     p_warn.add_argument("type", choices=list(WARNING_PATHS.keys()), help="Warning type")
+    p_warn.add_argument("--region", action="append", metavar="ARS",
+                        help="Only this region code, gemeinde/gemeinde_en only (repeatable)")
+    p_warn.add_argument("--at", nargs=2, type=float, metavar=("LAT", "LON"),
+                        help="Only warnings whose area contains this point")
+    p_warn.add_argument("--points", help="File of 'LAT LON' lines to test in one run ('-' for stdin)")
 
     sub.add_parser("crowd", help="Crowd-sourced weather reports")
 
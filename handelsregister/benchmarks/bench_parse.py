@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Benchmark the results grid parsers of scripts/handelsregister.py.
+
+Compares the streaming grid parser (get_companies_in_searchresults) with the
+BeautifulSoup tree parser (get_companies_in_searchresults_soup) on recorded
+result pages and reports rows/sec. Both parsers must return identical
+results, otherwise the benchmark fails.
+
+Without arguments a synthetic PrimeFaces result page is generated.
+
+    python3 handelsregister/benchmarks/bench_parse.py [PAGE.html ...] [--rows N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from handelsregister import get_companies_in_searchresults, get_companies_in_searchresults_soup, parse_search_page
+
+ROW = """<tr data-ri="{i}" class="ui-widget-content ui-datatable-even" role="row">
+<td role="gridcell"><span class="fontTableNameSize">{i}</span></td>
+<td role="gridcell">{state} <span class="fontWeightBold">Amtsgericht {court} HRB {num}</span></td>
+<td role="gridcell"><span class="marginLeft20">Beispiel {i} GmbH &amp; Co. KG</span></td>
+<td role="gridcell">{city}</td>
+<td role="gridcell"><span class="verticalText">currently registered</span></td>
+<td role="gridcell"><a id="ergebnissForm:selectedSuchErgebnisFormTable:{i}:j_idt161:0:fade_" href="#" onclick="return false;"><span class="dokumentList">AD</span></a>
+<a id="ergebnissForm:selectedSuchErgebnisFormTable:{i}:j_idt161:1:fade_" href="#"><span class="dokumentList">CD</span></a> <a href="#"><span class="dokumentList">HD</span></a></td>
+<td role="gridcell"></td>
+<td role="gridcell"><table><tr><td>History</td></tr></table></td>
+<td role="gridcell">1.) Alte Firma {i} GmbH</td><td role="gridcell">1.) {city}</td><td></td>
+</tr>
+"""
+
+PAGE = """<!DOCTYPE html><html><head><title>Handelsregister</title>
+<script type="text/javascript">var rows = "<tr data-ri='x'><td>no</td></tr>";</script></head>
+<body><div id="ergebnissForm:selectedSuchErgebnisFormTable" class="ui-datatable">
+<table role="navigation"><tr><td>Seite 1</td></tr></table>
+<div class="ui-datatable-tablewrapper"><table role="grid"><thead><tr role="row"><th>Nr.</th></tr></thead>
+<tbody id="ergebnissForm:selectedSuchErgebnisFormTable_data" class="ui-datatable-data">
+{rows}</tbody></table></div></div>
+<footer><table><tr data-ri="0"><td>not a result</td></tr></table></footer></body></html>
+"""
+
+STATES = [("Berlin", "Charlottenburg", "Berlin"), ("Bremen", "Bremen", "Bremen"),
+          ("Bayern", "München", "München"), ("Hamburg", "Hamburg", "Hamburg")]
+
+
+def synthetic_page(rows):
+    return PAGE.format(rows="".join(
+        ROW.format(i=i, state=STATES[i % 4][0], court=STATES[i % 4][1],
+                   city=STATES[i % 4][2], num=10000 + i)
+        for i in range(rows)))
+
+
+def rows_per_sec(parse, pages, repeat):
+    rows = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            rows += len(parse(html))
+    return rows / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Results grid parser benchmark")
+    parser.add_argument("pages", nargs="*", help="Recorded result pages (HTML)")
+    parser.add_argument("--rows", type=int, default=100, help="Rows of the synthetic page (default: 100)")
+    parser.add_argument("--repeat", type=int, default=20, help="Parses per page (default: 20)")
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = []
+        for path in args.pages:
+            with open(path, "r", encoding="utf-8") as f:
+                pages.append(f.read())
+    else:
+        pages = [synthetic_page(args.rows)]
+
+    for html in pages:
+        if parse_search_page(html) != get_companies_in_searchresults_soup(html, links=True):
+            sys.exit("Parsers disagree on a page")
+
+    soup = rows_per_sec(get_companies_in_searchresults_soup, pages, args.repeat)
+    fast = rows_per_sec(get_companies_in_searchresults, pages, args.repeat)
+    print(json.dumps({
+        "pages": len(pages),
+        "rows": sum(len(get_companies_in_searchresults(html)) for html in pages),
+        "soup_rows_per_sec": round(soup),
+        "grid_rows_per_sec": round(fast),
+        "speedup": round(fast / soup, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
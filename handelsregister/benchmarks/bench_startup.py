@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Measure the cold start of a cached search.py query.
+
+Seeds the result cache (in a throwaway TMPDIR) for one query, then runs
+`python -X importtime search.py -s QUERY` several times and reports the wall
+time and the import time. Fails if the cache hit imports mechanize or bs4,
+which are only needed for live queries.
+
+    python3 handelsregister/benchmarks/bench_startup.py [--runs N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SKILL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY_MODULES = ("mechanize", "bs4")
+QUERY = "Benchmark GmbH"
+
+
+def import_times(stderr, top_level=False):
+    """{module: cumulative microseconds} from -X importtime output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if top_level and name.startswith("  "):
+            continue
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def run(args, env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        env=env, capture_output=True, text=True, cwd=SKILL_DIR,
+    )
+    return time.perf_counter() - start, proc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark for cached queries")
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs (default: 10)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, TMPDIR=tmp)
+        seed = (
+            "import argparse, sys; sys.path.insert(0, 'scripts'); import handelsregister as hr; "
+            "args = argparse.Namespace(schlagwoerter=%r, schlagwortOptionen='all'); "
+            "hr.ResultCache(hr.CACHE_DIR).put(hr.query_params(args), [{}])" % QUERY
+        )
+        subprocess.run([sys.executable, "-c", seed], env=env, check=True, cwd=SKILL_DIR)
+
+        walls, imports = [], []
+        for _ in range(args.runs):
+            wall, proc = run(["search.py", "-s", QUERY], env)
+            if proc.returncode != 0 or proc.stdout.strip() != "{}":
+                sys.exit("Cached query failed: %s" % (proc.stdout + proc.stderr))
+            modules = import_times(proc.stderr)
+            heavy = [m for m in modules if m.split(".")[0] in HEAVY_MODULES]
+            if heavy:
+                sys.exit("Cache hit imported %s" % ", ".join(sorted(heavy)))
+            walls.append(wall)
+            imports.append(sum(import_times(proc.stderr, top_level=True).values()))
+
+        result = {
+            "runs": args.runs,
+            "wall_ms": round(statistics.median(walls) * 1000, 1),
+            "import_ms": round(statistics.median(imports) / 1000, 1),
+        }
+        _, proc = run(["-c", "import mechanize, bs4"], env)
+        if proc.returncode == 0:
+            # What every cache hit paid before mechanize and bs4 were imported lazily
+            result["mechanize_bs4_import_ms"] = round(
+                sum(us for m, us in import_times(proc.stderr).items() if m in HEAVY_MODULES) / 1000, 1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,19 @@ You can query, download, automate and much more, without using a web browser.
 """
 
 import argparse
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
 import tempfile
-import mechanize
+import threading
+import time
 import re
 import pathlib
+import shutil
 import sys
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 import urllib.parse
 
 # Dictionaries to map arguments to values
@@ -20,8 +27,244 @@ schlagwortOptionen = {
     "exact": 3
 }
 
+# mechanize and bs4 are imported lazily: a cache hit needs neither
+CACHE_DIR = pathlib.Path(tempfile.gettempdir()) / "handelsregister_cache"
+# Own subdirectory: CACHE_DIR also holds legacy cache files and the dependency stamp
+RESULT_CACHE_DIR = CACHE_DIR / "results"
+DEFAULT_CACHE_TTL = 24 * 3600
+DEFAULT_CACHE_SIZE = 512
+
+class ResultCache:
+    """Parsed search results keyed by a hash of all query parameters.
+
+    Entries are JSON files in `cachedir` plus an in-process LRU in front of them.
+    Entries older than `ttl` seconds are dropped on read, and the least recently
+    used files (by mtime, refreshed on every hit) are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, cachedir, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_SIZE):
+        self.cachedir = pathlib.Path(cachedir)
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = collections.OrderedDict()
+
+    @staticmethod
+    def key(params):
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return self.cachedir / ("%s.json" % key)
+
+    def get(self, params):
+        key = self.key(params)
+        entry = self.memory.get(key)
+        if entry is None:
+            try:
+                with open(self.path(key), "r") as f:
+                    entry = json.load(f)
+            except OSError:
+                return None
+            except ValueError:
+                entry = None
+            if not self._valid(entry):
+                # Truncated or not one of ours: a miss, and the file goes
+                self.path(key).unlink(missing_ok=True)
+                return None
+        if time.time() - entry["created"] > self.ttl:
+            self.memory.pop(key, None)
+            self.path(key).unlink(missing_ok=True)
+            return None
+        self._remember(key, entry)
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+        return entry["companies"]
+
+    @staticmethod
+    def _valid(entry):
+        return (isinstance(entry, dict) and isinstance(entry.get("created"), (int, float))
+                and isinstance(entry.get("companies"), list))
+
+    def put(self, params, companies):
+        key = self.key(params)
+        entry = {"created": time.time(), "params": params, "companies": companies}
+        tmp = self.path(key).with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, self.path(key))
+        self._remember(key, entry)
+        self._evict()
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        files = sorted(self.cachedir.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for path in files[:max(0, len(files) - self.max_entries)]:
+            self.memory.pop(path.stem, None)
+            path.unlink(missing_ok=True)
+
+
+DEFAULT_RATE_LIMIT = 60
+DEFAULT_BURST = 1
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` saved up."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Block until a token is available, then consume it. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+DOCUMENT_TYPES = ['AD', 'CD', 'HD', 'DK', 'UT', 'VÖ', 'SI']
+DEFAULT_DOCUMENT_DIR = pathlib.Path(tempfile.gettempdir()) / "handelsregister_documents"
+DEFAULT_DOWNLOAD_WORKERS = 2
+# The historical printout covers closed register sheets and never changes; every
+# other type follows the register entry, so a stored copy is re-fetched after a while
+IMMUTABLE_DOCUMENT_TYPES = ('HD',)
+DEFAULT_DOCUMENT_MAX_AGE = 7 * 24 * 3600
+DOWNLOAD_CHUNK = 1 << 16
+CONTENT_DISPOSITION_RE = re.compile(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', re.I)
+
+class DocumentStore:
+    """Downloaded documents, stored content-addressed.
+
+    Files live in objects/<sha256[:2]>/<sha256><ext>, so identical documents
+    are kept once. manifest.json maps each download key (see document_key) to
+    its object and the time it was fetched, so finished downloads are skipped
+    on the next run until they are older than the caller's max_age. Unfinished
+    downloads stay in partial/ and are resumed.
+    """
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        (self.root / "partial").mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / "manifest.json"
+        try:
+            with open(self.manifest_path, "r") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, max_age=None):
+        """Path of the stored document, or None if missing or fetched more than max_age seconds ago."""
+        entry = self.manifest.get(key)
+        if entry is None or not (self.root / entry["file"]).exists():
+            return None
+        if max_age is not None and time.time() - entry.get("fetched", 0) > max_age:
+            return None
+        return str(self.root / entry["file"])
+
+    def partial(self, key):
+        return self.root / "partial" / ("%s.part" % hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def commit(self, key, part, filename=None):
+        """Move a finished download into the object store and record it. Returns the path."""
+        digest = hashlib.sha256()
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        ext = os.path.splitext(filename or "")[1].lower()
+        relative = os.path.join("objects", digest[:2], digest + ext)
+        target = self.root / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists():
+            part.unlink()
+        else:
+            os.replace(part, target)
+        with self.lock:
+            self.manifest[key] = {"file": relative, "sha256": digest, "filename": filename,
+                                  "fetched": time.time()}
+            tmp = self.manifest_path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(self.manifest, f, indent=1)
+            os.replace(tmp, self.manifest_path)
+        return str(target)
+
+def document_types(value):
+    """argparse type for --documents: comma-separated document types, e.g. AD,CD,HD."""
+    types = [t.strip().upper() for t in value.split(",") if t.strip()]
+    unknown = [t for t in types if t not in DOCUMENT_TYPES]
+    if unknown:
+        raise argparse.ArgumentTypeError("unknown document type(s) %s, choose from %s" % (", ".join(unknown), ",".join(DOCUMENT_TYPES)))
+    return types
+
+def positive_int(value):
+    """argparse type for --max-results and --burst: a whole number of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got %s" % value)
+    return number
+
+def positive_float(value):
+    """argparse type for --rate-limit: a number greater than 0."""
+    number = float(value)
+    if not number > 0 or number == float("inf"):
+        raise argparse.ArgumentTypeError("must be greater than 0, got %s" % value)
+    return number
+
+def document_key(company, doc_type):
+    """Identifies a document across searches: court, register number (or name) and type."""
+    return "%s|%s|%s" % (company["court"], company["register_num"] or company["name"], doc_type)
+
+
+def query_params(args):
+    """All parameters that determine a search result, used as the cache key."""
+    return {
+        "schlagwoerter": args.schlagwoerter,
+        "schlagwortOptionen": args.schlagwortOptionen,
+        # Entries from before pagination only hold the first result page
+        "pages": "all",
+    }
+
+def cached_companies(args):
+    """Cached result for the query in `args`, or None.
+
+    Needs neither mechanize nor bs4, so a cache hit can be answered before
+    they are imported (or even installed).
+    """
+    if getattr(args, "force", False) or getattr(args, "documents", None):
+        return None
+    cache = ResultCache(
+        RESULT_CACHE_DIR,
+        ttl=getattr(args, "cache_ttl", DEFAULT_CACHE_TTL),
+        max_entries=getattr(args, "cache_size", DEFAULT_CACHE_SIZE),
+    )
+    companies = cache.get(query_params(args))
+    if companies is None:
+        return None
+    return companies[:getattr(args, "max_results", None)]
+
+
 class HandelsRegister:
     def __init__(self, args):
+        import mechanize
+
         self.args = args
         self.browser = mechanize.Browser()
 
@@ -35,6 +278,8 @@ class HandelsRegister:
         self.browser.set_handle_refresh(False)
         self.browser.set_handle_redirect(True)
         self.browser.set_handle_referer(True)
+        self.cookiejar = mechanize.CookieJar()
+        self.browser.set_cookiejar(self.cookiejar)
 
         self.browser.addheaders = [
             (
@@ -50,66 +295,234 @@ class HandelsRegister:
             (   "Connection", "keep-alive"    ),
         ]
         
-        self.cachedir = pathlib.Path(tempfile.gettempdir()) / "handelsregister_cache"
-        self.cachedir.mkdir(parents=True, exist_ok=True)
+        self.cachedir = RESULT_CACHE_DIR
+        # handelsregister.de allows 60 queries per hour (Paragraph 9 Abs. 1 HGB)
+        self.bucket = TokenBucket(
+            getattr(args, "rate_limit", DEFAULT_RATE_LIMIT) / 3600.0,
+            getattr(args, "burst", DEFAULT_BURST),
+        )
+        self.cache = ResultCache(
+            self.cachedir,
+            ttl=getattr(args, "cache_ttl", DEFAULT_CACHE_TTL),
+            max_entries=getattr(args, "cache_size", DEFAULT_CACHE_SIZE),
+        )
+        self.document_types = getattr(args, "documents", None) or []
+        self.download_workers = getattr(args, "download_workers", DEFAULT_DOWNLOAD_WORKERS)
+        self.document_max_age = getattr(args, "document_max_age", DEFAULT_DOCUMENT_MAX_AGE)
+        if self.document_types:
+            self.documents = DocumentStore(getattr(args, "download_dir", None) or DEFAULT_DOCUMENT_DIR)
+        self.view = None
 
     def open_startpage(self):
         self.browser.open("https://www.handelsregister.de", timeout=10)
 
-    def companyname2cachename(self, companyname):
-        return self.cachedir / companyname
+    def query_params(self):
+        return query_params(self.args)
 
     def search_company(self):
-        cachename = self.companyname2cachename(self.args.schlagwoerter)
-        if self.args.force==False and cachename.exists():
-            with open(cachename, "r") as f:
-                html = f.read()
+        return list(self.iter_companies())
+
+    def iter_companies(self):
+        """Yield the companies of every result page as soon as the page is parsed.
+
+        Stops after --max-results companies. Only complete result sets are cached.
+        With --documents the search always runs live (document links are only
+        valid within the session) and each company gets a "files" entry.
+        """
+        params = self.query_params()
+        max_results = getattr(self.args, "max_results", None)
+        if not self.args.force and not self.document_types:
+            companies = self.cache.get(params)
+            if companies is not None:
                 if not self.args.json:
                     print("return cached content for %s" % self.args.schlagwoerter)
-        else:
-            # TODO implement token bucket to abide by rate limit
-            # Use an atomic counter: https://gist.github.com/benhoyt/8c8a8d62debe8e5aa5340373f9c509c7
-            self.browser.select_form(name="naviForm")
-            self.browser.form.new_control('hidden', 'naviForm:erweiterteSucheLink', {'value': 'naviForm:erweiterteSucheLink'})
-            self.browser.form.new_control('hidden', 'target', {'value': 'erweiterteSucheLink'})
-            response_search = self.browser.submit()
-
-            if self.args.debug == True:
-                print(self.browser.title())
-
-            self.browser.select_form(name="form")
-
-            self.browser["form:schlagwoerter"] = self.args.schlagwoerter
-            so_id = schlagwortOptionen.get(self.args.schlagwortOptionen)
-
-            self.browser["form:schlagwortOptionen"] = [str(so_id)]
-
-            response_result = self.browser.submit()
-
-            if self.args.debug == True:
-                print(self.browser.title())
-
-            html = response_result.read().decode("utf-8")
-            with open(cachename, "w") as f:
-                f.write(html)
-
-            # TODO catch the situation if there's more than one company?
-            # TODO get all documents attached to the exact company
-            # TODO parse useful information out of the PDFs
-        return get_companies_in_searchresults(html)
-
+                yield from companies[:max_results]
+                return
+
+        if max_results is not None and max_results < 1:
+            return
+        companies = []
+        for page, links in self.result_pages():
+            if self.document_types:
+                files = self.download_documents(page[:max_results and max_results - len(companies)], links)
+            for i, company in enumerate(page):
+                companies.append(company)
+                yield dict(company, files=files[i]) if self.document_types else company
+                if len(companies) == max_results:
+                    return
+        self.cache.put(params, companies)
+
+    def result_pages(self):
+        """Submit the search form, then yield the parsed companies page by page.
+
+        Further pages are requested lazily over the same session, each one
+        taking a token from the rate limit.
+        """
+        self.bucket.take()
+        self.browser.select_form(name="naviForm")
+        self.browser.form.new_control('hidden', 'naviForm:erweiterteSucheLink', {'value': 'naviForm:erweiterteSucheLink'})
+        self.browser.form.new_control('hidden', 'target', {'value': 'erweiterteSucheLink'})
+        response_search = self.browser.submit()
+
+        if self.args.debug == True:
+            print(self.browser.title())
+
+        self.browser.select_form(name="form")
+
+        self.browser["form:schlagwoerter"] = self.args.schlagwoerter
+        so_id = schlagwortOptionen.get(self.args.schlagwortOptionen)
+
+        self.browser["form:schlagwortOptionen"] = [str(so_id)]
+
+        response_result = self.browser.submit()
+
+        if self.args.debug == True:
+            print(self.browser.title())
+
+        html = response_result.read().decode("utf-8")
+
+        # TODO catch the situation if there's more than one company?
+        # TODO parse useful information out of the PDFs
+        page, links = parse_search_page(html)
+        self.view = result_view(html, self.browser.geturl())
+        yield page, links
+
+        paginator = result_paginator(html)
+        if paginator is None or self.view is None:
+            return
+        first = len(page)
+        while page and (paginator['row_count'] is None or first < paginator['row_count']):
+            self.bucket.take()
+            page, links = self.result_page(paginator, first)
+            yield page, links
+            first += len(page)
+
+    def result_page(self, paginator, first):
+        """Companies and document links of the result page starting at row `first` (PrimeFaces AJAX paging)."""
+        import mechanize
+
+        table = paginator['table']
+        data = {
+            'javax.faces.partial.ajax': 'true',
+            'javax.faces.source': table,
+            'javax.faces.partial.execute': table,
+            'javax.faces.partial.render': table,
+            table + '_pagination': 'true',
+            table + '_first': str(first),
+            table + '_rows': str(paginator['rows']),
+            table + '_encodeFeature': 'true',
+            self.view['form']: self.view['form'],
+            'javax.faces.ViewState': self.view['viewstate'],
+        }
+        request = mechanize.Request(
+            self.view['action'],
+            data=urllib.parse.urlencode(data),
+            headers={'Faces-Request': 'partial/ajax', 'X-Requested-With': 'XMLHttpRequest'},
+        )
+        # open_novisit keeps the result page as the browser's current page
+        response = self.browser.open_novisit(request, timeout=10)
+        updates = partial_response_updates(response.read().decode('utf-8'))
+        for target, content in updates.items():
+            if 'javax.faces.ViewState' in target:
+                self.view['viewstate'] = content
+        return parse_search_page(updates.get(table, ''), in_grid=True)
+
+    def download_documents(self, page, links):
+        """Download the requested document types of every company on the current result page.
+
+        The links are only valid for the page the session is on, so this runs
+        before the next page is requested. Up to --download-workers downloads
+        run at once, each taking a token from the rate limit. Returns
+        {type: path} per company, {type: {"error": ...}} for failed downloads.
+        """
+        files = [{} for _ in page]
+        jobs = collections.OrderedDict()
+        for i, (company, company_links) in enumerate(zip(page, links)):
+            for doc_type in self.document_types:
+                link = company_links.get(doc_type)
+                if link is None:
+                    continue
+                key = document_key(company, doc_type)
+                max_age = None if doc_type in IMMUTABLE_DOCUMENT_TYPES else self.document_max_age
+                path = self.documents.get(key, max_age)
+                if path is not None:
+                    files[i][doc_type] = path
+                else:
+                    jobs.setdefault(key, (link, []))[1].append((i, doc_type))
+
+        if jobs and self.view is None:
+            raise ValueError('result page has no form to request documents from')
+        with concurrent.futures.ThreadPoolExecutor(self.download_workers) as pool:
+            futures = {pool.submit(self.download_document, key, link): key for key, (link, _) in jobs.items()}
+            for future in concurrent.futures.as_completed(futures):
+                key = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'error': str(getattr(e, 'reason', e))}
+                for i, doc_type in jobs[key][1]:
+                    files[i][doc_type] = result
+        return files
+
+    def download_document(self, key, link):
+        """Post the document link back to the result page and store the response.
+
+        A partial file left by an interrupted download is resumed with a
+        Range request; if the portal ignores it, the download starts over.
+        """
+        import mechanize
+
+        self.bucket.take()
+        part = self.documents.partial(key)
+        offset = part.stat().st_size if part.exists() else 0
+        data = {
+            self.view['form']: self.view['form'],
+            'javax.faces.ViewState': self.view['viewstate'],
+            link: link,
+        }
+        request = mechanize.Request(self.view['action'], data=urllib.parse.urlencode(data))
+        request.add_header('User-Agent', dict(self.browser.addheaders)['User-Agent'])
+        if offset:
+            request.add_header('Range', 'bytes=%d-' % offset)
+        # Own opener per download: mechanize.Browser is not thread-safe, the cookie jar is
+        opener = mechanize.build_opener(mechanize.HTTPCookieProcessor(self.cookiejar))
+        response = opener.open(request, timeout=60)
+        headers = response.info()
+        if headers.get('Content-Type', '').startswith('text/html'):
+            raise ValueError('portal returned a page instead of the document')
+        resumed = offset and response.code == 206
+        with open(part, 'ab' if resumed else 'wb') as f:
+            shutil.copyfileobj(response, f, DOWNLOAD_CHUNK)
+            received = f.tell() - (offset if resumed else 0)
+        expected = headers.get('Content-Length')
+        if expected is not None and received < int(expected):
+            # Keep the partial file, the next run resumes it
+            raise IOError('download interrupted after %d of %s bytes' % (received, expected))
+        filename = CONTENT_DISPOSITION_RE.search(headers.get('Content-Disposition', ''))
+        return self.documents.commit(key, part, filename.group(1) if filename else None)
+
+
+
+REGISTER_NUM_RE = re.compile(r'(HRA|HRB|GnR|VR|PR)\s*\d+(\s+[A-Z])?(?!\w)')
+
+REGISTER_SUFFIXES = {
+    'Berlin': {'HRB': ' B'},
+    'Bremen': {'HRA': ' HB', 'HRB': ' HB', 'GnR': ' HB', 'VR': ' HB', 'PR': ' HB'}
+}
 
+DOCUMENTS_CELL = 5
+HISTORY_START = 8
 
 def parse_result(result):
-    cells = []
-    for cellnum, cell in enumerate(result.find_all('td')):
-        cells.append(cell.text.strip())
+    return parse_cells([cell.text.strip() for cell in result.find_all('td')])
+
+def parse_cells(cells):
     d = {}
     d['court'] = cells[1]
     
     # Extract register number: HRB, HRA, VR, GnR followed by numbers (e.g. HRB 12345, VR 6789)
     # Also capture suffix letter if present (e.g. HRB 12345 B), but avoid matching start of words (e.g. " Formerly")
-    reg_match = re.search(r'(HRA|HRB|GnR|VR|PR)\s*\d+(\s+[A-Z])?(?!\w)', d['court'])
+    reg_match = REGISTER_NUM_RE.search(d['court'])
     d['register_num'] = reg_match.group(0) if reg_match else None
 
     d['name'] = cells[2]
@@ -119,19 +532,14 @@ def parse_result(result):
 
     # Ensure consistent register number suffixes (e.g. ' B' for Berlin HRB, ' HB' for Bremen) which might be implicit
     if d['register_num']:
-        suffix_map = {
-            'Berlin': {'HRB': ' B'},
-            'Bremen': {'HRA': ' HB', 'HRB': ' HB', 'GnR': ' HB', 'VR': ' HB', 'PR': ' HB'}
-        }
         reg_type = d['register_num'].split()[0]
-        suffix = suffix_map.get(d['state'], {}).get(reg_type)
+        suffix = REGISTER_SUFFIXES.get(d['state'], {}).get(reg_type)
         if suffix and not d['register_num'].endswith(suffix):
             d['register_num'] += suffix
-    d['documents'] = cells[5] # todo: get the document links
+    d['documents'] = cells[DOCUMENTS_CELL] # links: see parse_search_page
     d['history'] = []
-    hist_start = 8
 
-    for i in range(hist_start, len(cells), 3):
+    for i in range(HISTORY_START, len(cells), 3):
         if i + 1 >= len(cells):
             break
         if "Branches" in cells[i] or "Niederlassungen" in cells[i]:
@@ -147,11 +555,121 @@ def pr_company_info(c):
     for name, loc in c.get('history'):
         print(name, loc)
 
+GRID_ROLE_RE = re.compile(r'role\s*=\s*["\']?grid\b')
+GRID_FEED_SIZE = 1 << 14
+
+class GridParser(HTMLParser):
+    """Streaming parser for the data rows (tr[data-ri]) of the results grid.
+
+    Collects the text of every td of a row, nested ones included, the way
+    BeautifulSoup's result.find_all('td') / cell.text does, and the ids of the
+    document links (AD, CD, HD, ...) in the documents cell. Everything outside
+    of table[role=grid] is ignored.
+    """
+
+    def __init__(self, in_grid=False):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        # in_grid: the input is a fragment of grid rows, e.g. from an AJAX update
+        self.table_depth = 1 if in_grid else 0
+        self.row_depth = 0
+        self.cells = []
+        self.open_cells = []
+        self.links = {}
+        self.link = None
+        self.skip = 0
+        self.seen_grid = in_grid
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == 'table':
+            if self.table_depth:
+                self.table_depth += 1
+            elif dict(attrs).get('role') == 'grid':
+                self.table_depth = 1
+                self.seen_grid = True
+        elif not self.table_depth:
+            return
+        elif tag == 'tr':
+            if self.row_depth:
+                self.row_depth += 1
+            elif dict(attrs).get('data-ri') is not None:
+                self.row_depth = 1
+                self.cells = []
+                self.links = {}
+        elif tag == 'td' and self.row_depth:
+            self.open_cells.append(len(self.cells))
+            self.cells.append([])
+        elif tag == 'a' and DOCUMENTS_CELL in self.open_cells:
+            self.link = (dict(attrs).get('id'), [])
+        elif tag in ('script', 'style'):
+            self.skip += 1
+
+    def handle_endtag(self, tag):
+        if self.done or not self.table_depth:
+            return
+        if tag == 'table':
+            self.table_depth -= 1
+            self.done = not self.table_depth
+        elif tag == 'tr' and self.row_depth:
+            self.row_depth -= 1
+            if not self.row_depth:
+                self.rows.append(([''.join(c).strip() for c in self.cells], self.links))
+                self.open_cells = []
+        elif tag == 'td' and self.open_cells:
+            self.open_cells.pop()
+        elif tag == 'a' and self.link is not None:
+            link_id, text = self.link
+            if link_id:
+                self.links[''.join(text).strip()] = link_id
+            self.link = None
+        elif tag in ('script', 'style') and self.skip:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if self.open_cells and not self.skip:
+            for i in self.open_cells:
+                self.cells[i].append(data)
+            if self.link is not None:
+                self.link[1].append(data)
+
+def parse_grid_rows(html, in_grid=False):
+    """(cell texts, {document type: link id}) of each grid data row, or None if the page has no results grid."""
+    if in_grid:
+        start = 0
+    else:
+        match = GRID_ROLE_RE.search(html)
+        start = html.rfind('<table', 0, match.start()) if match else -1
+    if start < 0:
+        return None
+    parser = GridParser(in_grid)
+    for pos in range(start, len(html), GRID_FEED_SIZE):
+        parser.feed(html[pos:pos + GRID_FEED_SIZE])
+        if parser.done:
+            break
+    parser.close()
+    return parser.rows if parser.seen_grid else None
+
+def parse_search_page(html, in_grid=False):
+    """Companies of a result page and, per company, its document links {type: link id}."""
+    rows = parse_grid_rows(html, in_grid)
+    if rows is None:
+        return get_companies_in_searchresults_soup(html, links=True)
+    return [parse_cells(cells) for cells, _ in rows], [links for _, links in rows]
+
 def get_companies_in_searchresults(html):
+    return parse_search_page(html)[0]
+
+def get_companies_in_searchresults_soup(html, links=False):
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html, 'html.parser')
     grid = soup.find('table', role='grid')
   
     results = []
+    documents = []
     for result in grid.find_all('tr'):
         a = result.get('data-ri')
         if a is not None:
@@ -159,8 +677,76 @@ def get_companies_in_searchresults(html):
 
             d = parse_result(result)
             results.append(d)
+            documents.append(parse_document_links(result))
+    if links:
+        return results, documents
     return results
 
+def parse_document_links(result):
+    cells = result.find_all('td')
+    if len(cells) <= DOCUMENTS_CELL:
+        return {}
+    return {a.text.strip(): a['id'] for a in cells[DOCUMENTS_CELL].find_all('a') if a.get('id')}
+
+DATATABLE_RE = re.compile(r'PrimeFaces\.cw\(\s*["\']DataTable["\']')
+UPDATE_RE = re.compile(r'<update id="([^"]+)">(.*?)</update>', re.S)
+CDATA_RE = re.compile(r'<!\[CDATA\[(.*?)\]\]>', re.S)
+
+def tag_attribute(html, tag_re, name):
+    tag = re.search(tag_re, html)
+    if tag is None:
+        return None
+    value = re.search(r'\b%s\s*=\s*"([^"]*)"' % name, tag.group(0))
+    return value.group(1) if value else None
+
+def result_view(html, url):
+    """Form id, action URL and ViewState of the form around the results grid, or None.
+
+    Needed to post back to the result page: for AJAX paging and document links.
+    """
+    grid = GRID_ROLE_RE.search(html)
+    start = html.rfind('<form', 0, grid.start()) if grid else -1
+    if start < 0:
+        return None
+    form_tag = html[start:html.find('>', start) + 1]
+    form = tag_attribute(form_tag, r'<form\b[^>]*>', 'id')
+    action = tag_attribute(form_tag, r'<form\b[^>]*>', 'action')
+    viewstate = tag_attribute(html[start:], r'<input\b[^>]*name="javax\.faces\.ViewState"[^>]*>', 'value')
+    if form is None or action is None or viewstate is None:
+        return None
+    return {
+        'form': form,
+        'action': urllib.parse.urljoin(url, action.replace('&amp;', '&')),
+        'viewstate': viewstate,
+    }
+
+def result_paginator(html):
+    """Table id, page size and row count of the PrimeFaces results table, or None if there is only one page."""
+    match = DATATABLE_RE.search(html)
+    if match is None:
+        return None
+    end = html.find('PrimeFaces.cw(', match.end())
+    config = html[match.end():end if end >= 0 else None]
+    table = re.search(r'\bid\s*:\s*["\']([^"\']+)["\']', config)
+    rows = re.search(r'\brows\s*:\s*(\d+)', config)
+    row_count = re.search(r'\browCount\s*:\s*(\d+)', config)
+    if 'paginator' not in config or table is None or rows is None:
+        return None
+    if row_count and int(row_count.group(1)) <= int(rows.group(1)):
+        return None
+    return {
+        'table': table.group(1),
+        'rows': int(rows.group(1)),
+        'row_count': int(row_count.group(1)) if row_count else None,
+    }
+
+def partial_response_updates(xml):
+    """{id: content} of the <update> elements of a JSF partial response."""
+    return {
+        target: ''.join(CDATA_RE.findall(body)) if '<![CDATA[' in body else body
+        for target, body in UPDATE_RE.findall(xml)
+    }
+
 def parse_args():
     parser = argparse.ArgumentParser(description='A handelsregister CLI')
     parser.add_argument(
@@ -189,6 +775,58 @@ def parse_args():
                           choices=["all", "min", "exact"],
                           default="all"
                         )
+    parser.add_argument(
+                          "--max-results",
+                          help="Stop after this many companies (default: all result pages)",
+                          type=positive_int,
+                          default=None
+                        )
+    parser.add_argument(
+                          "--documents",
+                          help="Download these document types of every result, comma-separated (%s)" % ",".join(DOCUMENT_TYPES),
+                          type=document_types
+                        )
+    parser.add_argument(
+                          "--download-dir",
+                          help="Document store directory (default: %s)" % DEFAULT_DOCUMENT_DIR,
+                          default=DEFAULT_DOCUMENT_DIR
+                        )
+    parser.add_argument(
+                          "--download-workers",
+                          help="Parallel document downloads (default: %d)" % DEFAULT_DOWNLOAD_WORKERS,
+                          type=int,
+                          default=DEFAULT_DOWNLOAD_WORKERS
+                        )
+    parser.add_argument(
+                          "--document-max-age",
+                          help="Seconds a stored document other than HD is reused before it is downloaded again (default: %d)" % DEFAULT_DOCUMENT_MAX_AGE,
+                          type=int,
+                          default=DEFAULT_DOCUMENT_MAX_AGE
+                        )
+    parser.add_argument(
+                          "--cache-ttl",
+                          help="Seconds a cached result stays valid (default: %d)" % DEFAULT_CACHE_TTL,
+                          type=int,
+                          default=DEFAULT_CACHE_TTL
+                        )
+    parser.add_argument(
+                          "--cache-size",
+                          help="Max number of cached searches (default: %d)" % DEFAULT_CACHE_SIZE,
+                          type=int,
+                          default=DEFAULT_CACHE_SIZE
+                        )
+    parser.add_argument(
+                          "--rate-limit",
+                          help="Max live queries per hour (default: %d)" % DEFAULT_RATE_LIMIT,
+                          type=positive_float,
+                          default=DEFAULT_RATE_LIMIT
+                        )
+    parser.add_argument(
+                          "--burst",
+                          help="Live queries allowed back to back before rate limiting (default: %d)" % DEFAULT_BURST,
+                          type=positive_int,
+                          default=DEFAULT_BURST
+                        )
     parser.add_argument(
                           "-j",
                           "--json",
@@ -208,14 +846,17 @@ def parse_args():
     return args
 
 if __name__ == "__main__":
-    import json
     args = parse_args()
-    h = HandelsRegister(args)
-    h.open_startpage()
-    companies = h.search_company()
-    if companies is not None:
+    companies = cached_companies(args)
+    if companies is None:
+        h = HandelsRegister(args)
+        h.open_startpage()
+        companies = h.iter_companies()
+    elif not args.json:
+        print("return cached content for %s" % args.schlagwoerter)
+    # One JSON object per line (NDJSON) as the result pages arrive
+    for c in companies:
         if args.json:
-            print(json.dumps(companies))
+            print(json.dumps(c), flush=True)
         else:
-            for c in companies:
-                pr_company_info(c)
+            pr_company_info(c)
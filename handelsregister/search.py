@@ -4,23 +4,35 @@
 import subprocess
 import sys
 import importlib
+import importlib.util
 import os
 import argparse
 import json
+import pathlib
+import tempfile
 
 REQUIRED_PACKAGES = {
     "mechanize": "mechanize",
     "bs4": "beautifulsoup4",
 }
 
+# Written once all packages are present for this interpreter
+DEPS_STAMP = pathlib.Path(tempfile.gettempdir()) / "handelsregister_cache" / "dependencies.ok"
+
 
 def ensure_dependencies():
-    missing = []
-    for module, package in REQUIRED_PACKAGES.items():
-        try:
-            importlib.import_module(module)
-        except ImportError:
-            missing.append(package)
+    try:
+        if DEPS_STAMP.read_text() == sys.executable:
+            return
+    except OSError:
+        pass
+
+    # find_spec locates the packages without importing them
+    missing = [
+        package
+        for module, package in REQUIRED_PACKAGES.items()
+        if importlib.util.find_spec(module) is None
+    ]
 
     if missing:
         print(f"Installing missing dependencies: {', '.join(missing)}", file=sys.stderr)
@@ -29,10 +41,67 @@ def ensure_dependencies():
         )
         importlib.invalidate_caches()
 
+    DEPS_STAMP.parent.mkdir(parents=True, exist_ok=True)
+    DEPS_STAMP.write_text(sys.executable)
+
+
+def open_register(args):
+    from handelsregister import HandelsRegister
+
+    try:
+        return HandelsRegister(args)
+    except ImportError:
+        # Stale stamp, e.g. a package was removed since the last run
+        DEPS_STAMP.unlink(missing_ok=True)
+        ensure_dependencies()
+        return HandelsRegister(args)
+
+
+def read_keywords(path):
+    with open(path, "r") as f:
+        lines = (line.strip() for line in f)
+        return list(dict.fromkeys(l for l in lines if l and not l.startswith("#")))
 
-def main():
-    ensure_dependencies()
 
+def run_batch(h, args):
+    """Search every keyword of the batch file over one session, streaming NDJSON.
+
+    Finished keywords are appended to the checkpoint file, so a rerun resumes
+    where an interrupted run stopped. Failed keywords, and keywords with failed
+    document downloads, are not checkpointed.
+    """
+    checkpoint = pathlib.Path(args.checkpoint or args.batch + ".done")
+    done = set(checkpoint.read_text().splitlines()) if checkpoint.exists() else set()
+    session_open = False
+    with open(checkpoint, "a") as cp:
+        for keyword in read_keywords(args.batch):
+            if keyword in done:
+                continue
+            h.args.schlagwoerter = keyword
+            try:
+                if not session_open and (args.force or args.documents or h.cache.get(h.query_params()) is None):
+                    h.open_startpage()
+                    session_open = True
+                companies = h.search_company()
+            except Exception as e:
+                print(json.dumps({"keyword": keyword, "error": str(e)}), flush=True)
+                # Start over from the portal's start page on the next live query
+                session_open = False
+                continue
+            print(json.dumps({"keyword": keyword, "companies": companies or []}), flush=True)
+            if any(isinstance(f, dict) for c in companies or [] for f in c.get("files", {}).values()):
+                continue
+            cp.write(keyword + "\n")
+            cp.flush()
+
+
+def print_companies(companies):
+    """One NDJSON line per company, flushed so each result page shows up as soon as it is parsed."""
+    for company in companies:
+        print(json.dumps(company), flush=True)
+
+
+def main():
     # Add handelsregister source to path (local scripts/ dir first, then repo fallback)
     script_dir = os.path.dirname(os.path.abspath(__file__))
     scripts_dir = os.path.join(script_dir, "scripts")
@@ -45,10 +114,18 @@ def main():
         print(json.dumps({"error": "handelsregister.py not found in scripts/ or repo"}))
         sys.exit(1)
 
-    from handelsregister import HandelsRegister
+    # Cheap: mechanize and bs4 are only imported once a live query is needed
+    from handelsregister import (
+        DEFAULT_BURST, DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL, DEFAULT_DOCUMENT_DIR, DEFAULT_DOCUMENT_MAX_AGE,
+        DEFAULT_DOWNLOAD_WORKERS, DEFAULT_RATE_LIMIT, cached_companies, document_types, positive_float, positive_int,
+    )
 
     parser = argparse.ArgumentParser(description="Search the German Handelsregister")
-    parser.add_argument("-s", "--schlagwoerter", required=True, help="Search keywords")
+    parser.add_argument("-s", "--schlagwoerter", help="Search keywords")
+    parser.add_argument("-b", "--batch", metavar="FILE", help="Search every keyword in FILE (one per line), output NDJSON")
+    parser.add_argument("--checkpoint", help="Progress file for --batch (default: FILE.done)")
+    parser.add_argument("--rate-limit", type=positive_float, default=DEFAULT_RATE_LIMIT, help=f"Max live queries per hour (default: {DEFAULT_RATE_LIMIT})")
+    parser.add_argument("--burst", type=positive_int, default=DEFAULT_BURST, help=f"Live queries allowed back to back (default: {DEFAULT_BURST})")
     parser.add_argument(
         "-so",
         "--schlagwortOptionen",
@@ -57,23 +134,47 @@ def main():
         help="all=all keywords, min=at least one, exact=exact name",
     )
     parser.add_argument("-f", "--force", action="store_true", help="Skip cache")
+    parser.add_argument("--max-results", type=positive_int, help="Stop after this many companies (default: all result pages)")
+    parser.add_argument("--documents", type=document_types, help="Download these document types, comma-separated (e.g. AD,CD,HD)")
+    parser.add_argument("--download-dir", default=DEFAULT_DOCUMENT_DIR, help=f"Document store directory (default: {DEFAULT_DOCUMENT_DIR})")
+    parser.add_argument("--download-workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS, help=f"Parallel document downloads (default: {DEFAULT_DOWNLOAD_WORKERS})")
+    parser.add_argument("--document-max-age", type=int, default=DEFAULT_DOCUMENT_MAX_AGE, help=f"Seconds a stored document other than HD is reused (default: {DEFAULT_DOCUMENT_MAX_AGE})")
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_CACHE_TTL, help=f"Seconds a cached result stays valid (default: {DEFAULT_CACHE_TTL})")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help=f"Max number of cached searches (default: {DEFAULT_CACHE_SIZE})")
     parser.add_argument("-d", "--debug", action="store_true", help="Debug logging")
     args = parser.parse_args()
+    if not args.schlagwoerter and not args.batch:
+        parser.error("one of -s/--schlagwoerter or -b/--batch is required")
 
     # Always output JSON
     args.json = True
 
+    # Answer cache hits before checking dependencies or opening the portal
+    if not args.batch:
+        companies = cached_companies(args)
+        if companies is not None:
+            print_companies(companies)
+            return
+
+    ensure_dependencies()
+
     if args.debug:
         import logging
         logger = logging.getLogger("mechanize")
         logger.addHandler(logging.StreamHandler(sys.stderr))
         logger.setLevel(logging.DEBUG)
 
+    if args.batch:
+        try:
+            run_batch(open_register(args), args)
+        except KeyboardInterrupt:
+            sys.exit(130)
+        return
+
     try:
-        h = HandelsRegister(args)
+        h = open_register(args)
         h.open_startpage()
-        companies = h.search_company()
-        print(json.dumps(companies if companies else []))
+        print_companies(h.iter_companies())
     except Exception as e:
         print(json.dumps({"error": str(e)}))
         sys.exit(1)
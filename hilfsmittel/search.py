@@ -2,19 +2,44 @@
 """Query the GKV Hilfsmittelverzeichnis API for assistive devices."""
 
 import argparse
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
 import json
+import os
+import pathlib
+import sqlite3
 import sys
+import tempfile
+import time
 import urllib.request
 import urllib.error
 
+import httpclient
+
 BASE_URL = "https://hilfsmittel-api.gkv-spitzenverband.de/api/verzeichnis"
 
+CACHE_DIR = pathlib.Path(tempfile.gettempdir()) / "hilfsmittel_cache"
+PRODUKT_INDEX = CACHE_DIR / "produkte.sqlite"
+TREE_CACHE = CACHE_DIR / "tree.json"
+TREE_INDEX = CACHE_DIR / "tree.sqlite"
+
+TREE_LEVELS = (1, 2, 3, 4)
+TREE_TTL = 24 * 3600
+# --filter scans instead of using the trigram index if the rarest trigram is in more than 1/N of the nodes
+SCAN_FRACTION = 20
+
+CHUNK_SIZE = 1 << 16
+SEARCH_LIMIT = 20
+
 
 def api_get(path):
     url = f"{BASE_URL}{path}"
     try:
         req = urllib.request.Request(url, headers={"Accept": "application/json"})
-        with urllib.request.urlopen(req, timeout=30) as resp:
+        with httpclient.urlopen(req, timeout=30) as resp:
             return json.loads(resp.read().decode("utf-8"))
     except urllib.error.HTTPError as e:
         print(json.dumps({"error": f"HTTP {e.code} for {url}"}))
@@ -24,13 +49,239 @@ def api_get(path):
         sys.exit(1)
 
 
+def api_stream(path):
+    """Yield the elements of a top-level JSON array without loading the whole response.
+
+    Raises HTTPError/URLError (also for a body cut short) and ValueError, so the
+    caller can clean up what it built from the stream before reporting.
+    """
+    req = urllib.request.Request(f"{BASE_URL}{path}", headers={"Accept": "application/json"})
+    with httpclient.urlopen(req, timeout=30) as resp:
+        yield from iter_json_array(resp)
+
+
+def stream_error(e, path):
+    if isinstance(e, urllib.error.HTTPError):
+        return f"HTTP {e.code} for {BASE_URL}{path}"
+    if isinstance(e, urllib.error.URLError):
+        return f"Connection failed: {e.reason}"
+    if isinstance(e, ValueError):
+        return f"Invalid {path} listing: {e}"
+    return f"Connection failed: {e}"
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """Incrementally decode a JSON array from a byte stream, one element at a time."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos, eof, opened = "", 0, False, False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf):
+            if not opened:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                opened, pos = True, pos + 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                end = None
+            # An element ending exactly at the buffer edge may still be cut off
+            if end is not None and (end < len(buf) or eof):
+                yield item
+                pos = end
+                continue
+        if eof:
+            raise ValueError("Truncated JSON array")
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + utf8.decode(chunk, final=eof), 0
+
+
+def fetch_tree_level(level, cached):
+    """Revalidate one tree level against the cached copy.
+
+    Sends If-None-Match/If-Modified-Since when the server handed out validators
+    and falls back to comparing a content hash, so unchanged levels are neither
+    re-decoded nor re-indexed. Returns (entry, changed).
+    """
+    url = f"{BASE_URL}/VerzeichnisTree/{level}"
+    headers = {"Accept": "application/json"}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("lastModified"):
+        headers["If-Modified-Since"] = cached["lastModified"]
+    try:
+        req = urllib.request.Request(url, headers=headers)
+        with httpclient.urlopen(req, timeout=30) as resp:
+            raw = resp.read()
+            etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and "nodes" in cached:
+            return dict(cached, checked=time.time()), False
+        print(json.dumps({"error": f"HTTP {e.code} for {url}"}))
+        sys.exit(1)
+    except urllib.error.URLError as e:
+        print(json.dumps({"error": f"Connection failed: {e.reason}"}))
+        sys.exit(1)
+    digest = hashlib.sha256(raw).hexdigest()
+    changed = digest != cached.get("sha256")
+    nodes = json.loads(raw.decode("utf-8")) if changed else cached["nodes"]
+    entry = {"nodes": nodes, "sha256": digest, "etag": etag, "lastModified": last_modified,
+             "checked": time.time()}
+    return entry, changed
+
+
+def load_tree(refresh=False):
+    """Return the cached tree levels, revalidating missing or stale levels in parallel."""
+    try:
+        with open(TREE_CACHE, "r") as f:
+            levels = json.load(f)
+    except (OSError, ValueError):
+        levels = {}
+    now = time.time()
+    stale = [lvl for lvl in TREE_LEVELS
+             if refresh or now - levels.get(str(lvl), {}).get("checked", 0) > TREE_TTL]
+    changed = {}
+    if stale:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(stale)) as pool:
+            futures = {lvl: pool.submit(fetch_tree_level, lvl, levels.get(str(lvl), {})) for lvl in stale}
+            for lvl, fut in futures.items():
+                levels[str(lvl)], changed[lvl] = fut.result()
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = TREE_CACHE.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(levels, f)
+        os.replace(tmp, TREE_CACHE)
+        if any(changed.values()):
+            build_tree_index(levels)
+    return levels, changed
+
+
+def trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def tree_digest(levels):
+    """Identifies the cached tree content, so the trigram index can tell whether it is current."""
+    return hashlib.sha256(" ".join(levels.get(str(lvl), {}).get("sha256") or "" for lvl in TREE_LEVELS)
+                          .encode()).hexdigest()
+
+
+def build_tree_index(levels):
+    """Write the trigram -> node id index of displayValue and xSteller to tree.sqlite."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = TREE_INDEX.with_suffix(".sqlite.tmp")
+    tmp.unlink(missing_ok=True)
+    postings = sorted({
+        (g, node["id"])
+        for lvl in TREE_LEVELS for node in levels.get(str(lvl), {}).get("nodes", [])
+        for g in trigrams(node.get("displayValue") or "") | trigrams(node.get("xSteller") or "")})
+    with contextlib.closing(sqlite3.connect(tmp)) as con:
+        con.execute("PRAGMA journal_mode = OFF")
+        con.execute("CREATE TABLE gram (gram TEXT, id TEXT, PRIMARY KEY (gram, id)) WITHOUT ROWID")
+        con.execute("CREATE TABLE df (gram TEXT PRIMARY KEY, n INTEGER) WITHOUT ROWID")
+        con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        con.executemany("INSERT INTO gram VALUES (?, ?)", postings)
+        con.executemany("INSERT INTO df VALUES (?, ?)", collections.Counter(g for g, _ in postings).items())
+        con.execute("INSERT INTO meta VALUES ('digest', ?)", (tree_digest(levels),))
+        con.commit()
+    os.replace(tmp, TREE_INDEX)
+
+
+def open_tree_index(levels):
+    """Read-only connection to the trigram index, rebuilt first if it does not match the cached tree."""
+    try:
+        with contextlib.closing(sqlite3.connect(f"file:{TREE_INDEX}?mode=ro", uri=True)) as con:
+            current = con.execute("SELECT value FROM meta WHERE key = 'digest'").fetchone() == (tree_digest(levels),)
+    except sqlite3.Error:
+        current = False
+    if not current:
+        build_tree_index(levels)
+    return sqlite3.connect(f"file:{TREE_INDEX}?mode=ro", uri=True)
+
+
+class TreeIndex:
+    """VerzeichnisTree with parent/child links; --filter looks up candidates in the trigram index."""
+
+    def __init__(self, levels, grams=None):
+        self.grams = grams
+        self.nodes = {}
+        self.children = {}
+        self.by_xsteller = {}
+        for lvl in TREE_LEVELS:
+            for node in levels.get(str(lvl), {}).get("nodes", []):
+                self.nodes[node["id"]] = node
+                self.children.setdefault(node.get("parentId"), []).append(node["id"])
+                if node.get("xSteller"):
+                    self.by_xsteller[node["xSteller"]] = node["id"]
+
+    def candidates(self, needle):
+        """Nodes that have every trigram of needle; all nodes for short or very common needles."""
+        grams = trigrams(needle)
+        if not grams or self.grams is None:
+            return self.nodes.values()
+        df = dict(self.grams.execute(f"SELECT gram, n FROM df WHERE gram IN ({', '.join('?' * len(grams))})",
+                                     list(grams)))
+        if len(df) < len(grams):
+            return []
+        rarest, *rest = sorted(grams, key=df.get)
+        if df[rarest] * SCAN_FRACTION > len(self.nodes):
+            # Probing most of the tree costs more than the plain scan
+            return self.nodes.values()
+        # Walk the postings of the rarest trigram and probe the others by primary key
+        joins = "".join(f" JOIN gram g{i} ON g{i}.gram = ? AND g{i}.id = g.id" for i in range(len(rest)))
+        rows = self.grams.execute(f"SELECT g.id FROM gram g{joins} WHERE g.gram = ?", rest + [rarest])
+        return [self.nodes[i] for (i,) in rows if i in self.nodes]
+
+    def filter(self, needle, level=None):
+        """Nodes whose displayValue or xSteller contains needle (case-insensitive)."""
+        needle = needle.lower()
+        hits = []
+        for node in self.candidates(needle):
+            if level is not None and node.get("level") != level:
+                continue
+            if needle in node.get("displayValue", "").lower() or needle in node.get("xSteller", "").lower():
+                hits.append(node)
+        return sorted(hits, key=lambda n: (n.get("level") or 0, n.get("xSteller") or "", n["id"]))
+
+    def resolve(self, key):
+        """Look up a node by UUID or xSteller."""
+        return self.nodes.get(key) or self.nodes.get(self.by_xsteller.get(key))
+
+    def subtree(self, node_id):
+        node = dict(self.nodes[node_id])
+        kids = [self.subtree(c) for c in self.children.get(node_id, [])]
+        if kids:
+            node["children"] = sorted(kids, key=lambda n: n.get("xSteller") or "")
+        return node
+
+
 def cmd_tree(args):
-    data = api_get(f"/VerzeichnisTree/{args.level}")
-    if args.filter:
-        needle = args.filter.lower()
-        data = [n for n in data if needle in n.get("displayValue", "").lower()
-                or needle in n.get("xSteller", "").lower()]
-    print(json.dumps(data))
+    levels, changed = load_tree(refresh=args.refresh)
+    if args.refresh and args.level is None and not args.filter and not args.under:
+        print(json.dumps({"levels": {lvl: {"nodes": len(levels[str(lvl)]["nodes"]), "changed": changed[lvl]}
+                                     for lvl in TREE_LEVELS}}))
+        return
+    tree = TreeIndex(levels, open_tree_index(levels) if args.filter else None)
+    if args.under:
+        node = tree.resolve(args.under)
+        if node is None:
+            print(json.dumps({"error": f"No tree node with id or xSteller '{args.under}'"}))
+            sys.exit(1)
+        print(json.dumps(tree.subtree(node["id"])))
+    elif args.filter:
+        print(json.dumps(tree.filter(args.filter, args.level)))
+    elif args.level is not None:
+        print(json.dumps(levels[str(args.level)]["nodes"]))
+    else:
+        print(json.dumps({"error": "Provide LEVEL, --filter or --under"}))
+        sys.exit(1)
 
 
 def cmd_produktgruppe(args):
@@ -46,11 +297,92 @@ def cmd_produktart(args):
 
 
 def cmd_produkt(args):
-    if args.id:
+    if args.action == "search":
+        cmd_produkt_search(args)
+    elif args.id:
         print(json.dumps(api_get(f"/Produkt/{args.id}")))
     else:
-        print(json.dumps({"error": "Listing all products returns 30MB+. Provide --id or use 'tree' to browse."}))
+        print(json.dumps({"error": "Listing all products returns 30MB+. Provide --id, use 'produkt search' "
+                                   "after 'index build', or use 'tree' to browse."}))
+        sys.exit(1)
+
+
+def normalize_pos(value):
+    """Reduce a Positionsnummer to its digits (18.50.01.0002 -> 1850010002)."""
+    return "".join(c for c in value if c.isdigit())
+
+
+def produkt_row(p):
+    name = p.get("name") or ""
+    hersteller = p.get("herstellerName") or ""
+    zehn = p.get("zehnSteller") or ""
+    return (p.get("id"), name, hersteller, zehn, normalize_pos(zehn), f"{name} {hersteller}".lower())
+
+
+def cmd_index(args):
+    if args.action == "status":
+        con = open_index()
+        meta = dict(con.execute("SELECT key, value FROM meta"))
+        print(json.dumps({"path": str(PRODUKT_INDEX), "produkte": int(meta.get("count", 0)),
+                          "built": meta.get("built")}))
+        return
+    # Stream /Produkt straight into a fresh database, then swap it in atomically
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = PRODUKT_INDEX.with_suffix(".tmp")
+    tmp.unlink(missing_ok=True)
+    started = time.monotonic()
+    con = sqlite3.connect(tmp)
+    con.execute("PRAGMA journal_mode = OFF")
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute("CREATE TABLE produkt (id TEXT PRIMARY KEY, name TEXT, hersteller TEXT, "
+                "zehnsteller TEXT, pos TEXT, haystack TEXT)")
+    con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    rows = (produkt_row(p) for p in api_stream("/Produkt") if isinstance(p, dict) and p.get("id"))
+    try:
+        count = con.executemany("INSERT OR REPLACE INTO produkt VALUES (?, ?, ?, ?, ?, ?)", rows).rowcount
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        # Never leave a half-built index behind
+        con.close()
+        tmp.unlink(missing_ok=True)
+        print(json.dumps({"error": stream_error(e, "/Produkt")}))
         sys.exit(1)
+    con.execute("CREATE INDEX produkt_pos ON produkt (pos)")
+    built = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    con.executemany("INSERT INTO meta VALUES (?, ?)", [("count", str(count)), ("built", built)])
+    con.commit()
+    con.close()
+    os.replace(tmp, PRODUKT_INDEX)
+    print(json.dumps({"path": str(PRODUKT_INDEX), "produkte": count, "built": built,
+                      "seconds": round(time.monotonic() - started, 1)}))
+
+
+def open_index():
+    if not PRODUKT_INDEX.exists():
+        print(json.dumps({"error": "No product index. Run 'index build' first."}))
+        sys.exit(1)
+    return sqlite3.connect(f"file:{PRODUKT_INDEX}?mode=ro", uri=True)
+
+
+def cmd_produkt_search(args):
+    con = open_index()
+    query = args.query.strip()
+    digits = normalize_pos(query)
+    if digits and len(digits) == len(query.replace(".", "").replace(" ", "")):
+        # Positionsnummer prefix: range scan on the pos index
+        where, params = "pos >= ? AND pos < ?", [digits, digits + ":"]
+    else:
+        terms = query.lower().split()
+        where = " AND ".join(["instr(haystack, ?) > 0"] * len(terms)) or "1"
+        params = terms
+    total = con.execute(f"SELECT COUNT(*) FROM produkt WHERE {where}", params).fetchone()[0]
+    rows = con.execute(f"SELECT id, name, hersteller, zehnsteller FROM produkt WHERE {where} "
+                       "ORDER BY pos, name LIMIT ?", params + [args.limit])
+    result = {"produkte": [{"id": r[0], "name": r[1], "herstellerName": r[2], "zehnSteller": r[3]}
+                           for r in rows]}
+    if total > args.limit:
+        result["_total"] = total
+        result["_showing"] = args.limit
+    print(json.dumps(result))
 
 
 def cmd_nachweis(args):
@@ -62,8 +394,10 @@ def main():
     sub = parser.add_subparsers(dest="command", required=True)
 
     p_tree = sub.add_parser("tree", help="Browse product tree (levels 1-4)")
-    p_tree.add_argument("level", type=int, choices=[1, 2, 3, 4], help="Tree depth level")
-    p_tree.add_argument("--filter", help="Filter nodes by name or xSteller (case-insensitive)")
+    p_tree.add_argument("level", type=int, nargs="?", choices=TREE_LEVELS, help="Tree depth level")
+    p_tree.add_argument("--filter", help="Filter nodes by name or xSteller (case-insensitive, all levels if LEVEL omitted)")
+    p_tree.add_argument("--under", help="Show the subtree under a node (UUID or xSteller)")
+    p_tree.add_argument("--refresh", action="store_true", help="Revalidate the cached tree now")
 
     p_pg = sub.add_parser("produktgruppe", help="Get product group details")
     p_pg.add_argument("id", help="Product group UUID")
@@ -74,12 +408,19 @@ def main():
     p_pa = sub.add_parser("produktart", help="Get product type details")
     p_pa.add_argument("id", help="Product type UUID")
 
-    p_pr = sub.add_parser("produkt", help="Get product details")
+    p_pr = sub.add_parser("produkt", help="Get product details or search the local index")
     p_pr.add_argument("--id", help="Product UUID (required, full list is 30MB+)")
+    pr_sub = p_pr.add_subparsers(dest="action")
+    p_prs = pr_sub.add_parser("search", help="Search products by name, manufacturer or Positionsnummer")
+    p_prs.add_argument("query", help="Search terms or Positionsnummer prefix (e.g. 18.50.01)")
+    p_prs.add_argument("--limit", type=int, default=SEARCH_LIMIT, help=f"Max results (default: {SEARCH_LIMIT})")
 
     p_nw = sub.add_parser("nachweis", help="Get proof/evidence schema")
     p_nw.add_argument("id", help="Nachweisschema UUID")
 
+    p_idx = sub.add_parser("index", help="Local product index for 'produkt search'")
+    p_idx.add_argument("action", choices=["build", "status"], help="build = stream /Produkt into the index")
+
     args = parser.parse_args()
 
     commands = {
@@ -89,6 +430,7 @@ def main():
         "produktart": cmd_produktart,
         "produkt": cmd_produkt,
         "nachweis": cmd_nachweis,
+        "index": cmd_index,
     }
     commands[args.command](args)
 
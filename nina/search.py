@@ -2,21 +2,30 @@
 """Query the NINA warning API for German civil protection alerts."""
 
 import argparse
+import concurrent.futures
+import hashlib
 import json
 import sys
+import threading
+import time
 import urllib.request
 import urllib.error
 
+import httpclient
+
 BASE_URL = "https://warnung.bund.de/api31"
 
 SOURCES = ["dwd", "mowas", "katwarn", "biwapp", "lhp", "police"]
 
+WATCH_INTERVAL = 10
+BATCH_WORKERS = 8
+
 
 def api_get(path):
     url = f"{BASE_URL}{path}"
     try:
         req = urllib.request.Request(url, headers={"Accept": "application/json"})
-        with urllib.request.urlopen(req, timeout=15) as resp:
+        with httpclient.urlopen(req, timeout=15) as resp:
             return json.loads(resp.read().decode("utf-8"))
     except urllib.error.HTTPError as e:
         print(json.dumps({"error": f"HTTP {e.code} for {url}"}))
@@ -41,6 +50,144 @@ def cmd_mapdata(args):
     print(json.dumps(data))
 
 
+def fetch_conditional(path, validators):
+    """GET with If-None-Match/If-Modified-Since. Returns (data, validators); data is None on 304.
+
+    Raises urllib errors instead of exiting so a long-running poller can carry on.
+    """
+    headers = {"Accept": "application/json"}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("lastModified"):
+        headers["If-Modified-Since"] = validators["lastModified"]
+    req = urllib.request.Request(f"{BASE_URL}{path}", headers=headers)
+    try:
+        with httpclient.urlopen(req, timeout=15) as resp:
+            data = json.loads(resp.read().decode("utf-8"))
+            return data, {"etag": resp.headers.get("ETag"), "lastModified": resp.headers.get("Last-Modified")}
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, validators
+        raise
+
+
+def entry_hash(entry):
+    return hashlib.sha1(json.dumps(entry, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def emit(event):
+    sys.stdout.write(json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+
+def diff_source(source, known, data, now):
+    """Compare a source's mapData with the known {id: hash} map and emit change events."""
+    current = {}
+    for entry in data if isinstance(data, list) else []:
+        wid = entry.get("id")
+        if wid is None:
+            continue
+        digest = entry_hash(entry)
+        current[wid] = digest
+        if wid not in known:
+            emit({"event": "added", "source": source, "id": wid, "time": now, "warning": entry})
+        elif known[wid] != digest:
+            emit({"event": "updated", "source": source, "id": wid, "time": now, "warning": entry})
+    for wid in known.keys() - current.keys():
+        emit({"event": "expired", "source": source, "id": wid, "time": now})
+    return current
+
+
+def cmd_watch(args):
+    sources = args.source or SOURCES
+    validators = {src: {} for src in sources}
+    known = {src: {} for src in sources}
+    polls = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        while True:
+            started = time.monotonic()
+            futures = {pool.submit(fetch_conditional, f"/{src}/mapData.json", validators[src]): src
+                       for src in sources}
+            for fut in concurrent.futures.as_completed(futures):
+                src = futures[fut]
+                now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+                try:
+                    data, validators[src] = fut.result()
+                except urllib.error.HTTPError as e:
+                    emit({"event": "error", "source": src, "time": now, "error": f"HTTP {e.code}"})
+                    continue
+                except (urllib.error.URLError, OSError, ValueError) as e:
+                    emit({"event": "error", "source": src, "time": now, "error": str(getattr(e, "reason", e))})
+                    continue
+                if data is not None:
+                    known[src] = diff_source(src, known[src], data, now)
+            polls += 1
+            if args.count and polls >= args.count:
+                return
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+
+
+class Memo:
+    """Thread-safe memo of in-flight and finished fetches, so each key is requested once per run."""
+
+    def __init__(self, pool, fn):
+        self.pool = pool
+        self.fn = fn
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def get(self, key):
+        with self.lock:
+            fut = self.futures.get(key)
+            if fut is None:
+                fut = self.futures[key] = self.pool.submit(self.fn, key)
+            return fut
+
+
+def read_ars_codes(path):
+    f = sys.stdin if path == "-" else open(path, "r")
+    with f:
+        codes = [c for line in f for c in line.split("#", 1)[0].replace(",", " ").split()]
+    return list(dict.fromkeys(codes))
+
+
+def error_text(e):
+    return f"HTTP {e.code}" if isinstance(e, urllib.error.HTTPError) else str(getattr(e, "reason", e))
+
+
+def cmd_dashboard_batch(args):
+    codes = read_ars_codes(args.file)
+    if not codes:
+        print(json.dumps({"error": "No ARS codes given"}))
+        sys.exit(1)
+    districts, errors = {}, {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+        details = Memo(pool, lambda wid: fetch_conditional(f"/warnings/{wid}.json", {})[0])
+        futures = {pool.submit(fetch_conditional, f"/dashboard/{ars}.json", {}): ars for ars in codes}
+        for fut in concurrent.futures.as_completed(futures):
+            ars = futures[fut]
+            try:
+                entries = fut.result()[0] or []
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                errors[ars] = error_text(e)
+                continue
+            districts[ars] = [e["id"] for e in entries if isinstance(e, dict) and e.get("id")]
+            # Neighbouring districts share warnings; the memo fetches each one only once
+            for wid in districts[ars]:
+                details.get(wid)
+        warnings = {}
+        for wid, fut in details.futures.items():
+            try:
+                warnings[wid] = fut.result()
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                warnings[wid] = {"error": error_text(e)}
+    result = {"districts": {ars: districts[ars] for ars in codes if ars in districts}, "warnings": warnings,
+              "_requests": {"dashboard": len(codes), "details": len(warnings)}}
+    if errors:
+        result["errors"] = errors
+    print(json.dumps(result))
+
+
 def main():
     parser = argparse.ArgumentParser(description="Query German NINA warning API")
     sub = parser.add_subparsers(dest="command", required=True)
@@ -54,12 +201,25 @@ def main():
     p_map = sub.add_parser("mapdata", help="All current warnings from a source")
     p_map.add_argument("source", choices=SOURCES, help="Warning source")
 
+    p_batch = sub.add_parser("dashboard-batch", help="Warnings for many districts, details fetched once each")
+    p_batch.add_argument("--file", default="-", help="File with ARS codes, one or more per line (default: stdin)")
+    p_batch.add_argument("--workers", type=int, default=BATCH_WORKERS,
+                         help=f"Concurrent requests (default: {BATCH_WORKERS})")
+
+    p_watch = sub.add_parser("watch", help="Poll mapData of all sources, emit NDJSON change events")
+    p_watch.add_argument("--source", action="append", choices=SOURCES, help="Only this source (repeatable)")
+    p_watch.add_argument("--interval", type=float, default=WATCH_INTERVAL,
+                         help=f"Seconds between polls (default: {WATCH_INTERVAL})")
+    p_watch.add_argument("--count", type=int, default=0, help="Stop after N polls (default: run forever)")
+
     args = parser.parse_args()
 
     commands = {
         "dashboard": cmd_dashboard,
+        "dashboard-batch": cmd_dashboard_batch,
         "details": cmd_details,
         "mapdata": cmd_mapdata,
+        "watch": cmd_watch,
     }
     commands[args.command](args)
 
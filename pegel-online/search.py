@@ -2,36 +2,80 @@
 """Query the Pegel-Online API for German water level data."""
 
 import argparse
+import array
+import bisect
+import concurrent.futures
+import datetime
 import json
+import mmap
+import os
+import pathlib
+import re
+import struct
 import sys
+import tempfile
+import time
 import urllib.request
 import urllib.error
 import urllib.parse
 
+import httpclient
+
 BASE_URL = "https://www.pegelonline.wsv.de/webservices/rest-api/v2"
 
+SLICE_HOURS = 24
+MEASUREMENT_WORKERS = 8
+RESAMPLE_SECONDS = {"1h": 3600, "1d": 86400}
 
-def api_get(path, params=None):
+CACHE_DIR = pathlib.Path(tempfile.gettempdir()) / "pegel_online_cache"
+# The store keeps history past the API's 31 days, so it must not live in the temp dir
+DATA_HOME = pathlib.Path(os.environ.get("XDG_DATA_HOME") or pathlib.Path.home() / ".local" / "share")
+STORE_DIR = pathlib.Path(os.environ.get("PEGEL_ONLINE_STORE") or DATA_HOME / "pegel-online" / "store")
+
+# Store record: epoch seconds (int64) + value (float64), little-endian
+RECORD = struct.Struct("<qd")
+MAX_HISTORY = "P31D"
+
+try:
+    from zoneinfo import ZoneInfo
+    LOCAL_TZ = ZoneInfo("Europe/Berlin")
+except Exception:
+    LOCAL_TZ = datetime.timezone.utc
+
+PERIOD_RE = re.compile(r"^P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+
+def fetch_json(path, params=None):
+    """GET one API path. Raises urllib errors instead of exiting, for long-running and bulk use."""
     url = f"{BASE_URL}{path}"
     if params:
         filtered = {k: v for k, v in params.items() if v is not None}
         if filtered:
             url += "&" if "?" in url else "?"
             url += urllib.parse.urlencode(filtered)
-    try:
-        req = urllib.request.Request(url, headers={"Accept": "application/json"})
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
+    req = urllib.request.Request(url, headers={"Accept": "application/json"})
+    with httpclient.urlopen(req, timeout=15) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def error_text(e):
+    """Message for a failed request: the API's msg for HTTP errors, else the connection error."""
+    if isinstance(e, urllib.error.HTTPError):
         body = e.read().decode("utf-8", errors="replace")
         try:
-            msg = json.loads(body).get("msg", f"HTTP {e.code}")
+            return json.loads(body).get("msg", f"HTTP {e.code}")
         except Exception:
-            msg = f"HTTP {e.code}: {body[:200]}"
-        print(json.dumps({"error": msg}))
-        sys.exit(1)
+            return f"HTTP {e.code}: {body[:200]}"
+    if isinstance(e, urllib.error.URLError):
+        return f"Connection failed: {e.reason}"
+    return str(e)
+
+
+def api_get(path, params=None):
+    try:
+        return fetch_json(path, params)
     except urllib.error.URLError as e:
-        print(json.dumps({"error": f"Connection failed: {e.reason}"}))
+        print(json.dumps({"error": error_text(e)}))
         sys.exit(1)
 
 
@@ -60,16 +104,316 @@ def cmd_station(args):
     print(json.dumps(data))
 
 
-def cmd_measurements(args):
-    station_id = urllib.parse.quote(args.id, safe="")
-    ts = urllib.parse.quote(args.timeseries, safe="")
+def parse_time(value, now):
+    """ISO 8601 timestamp or period (P7D, PT12H, P1W) before `now` -> aware datetime, or None.
+
+    Timestamps without an offset are German local time. Results are whole seconds.
+    """
+    match = PERIOD_RE.match(value.upper())
+    if match and any(match.groups()):
+        w, d, h, m, sec = (int(g or 0) for g in match.groups())
+        dt = now - datetime.timedelta(weeks=w, days=d, hours=h, minutes=m, seconds=sec)
+        return dt.replace(microsecond=0)
+    try:
+        dt = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return (dt if dt.tzinfo else dt.replace(tzinfo=LOCAL_TZ)).replace(microsecond=0)
+
+
+class Series:
+    """Measurement series in flat arrays: epoch seconds, UTC offset in minutes, value."""
+
+    def __init__(self):
+        self.ts = array.array("d")
+        self.offset = array.array("h")
+        self.values = array.array("d")
+
+    def __len__(self):
+        return len(self.ts)
+
+    def append(self, timestamp, value):
+        dt = datetime.datetime.fromisoformat(timestamp)
+        self.add(dt.timestamp(), int(dt.utcoffset().total_seconds() // 60) if dt.utcoffset() else 0, value)
+
+    def add(self, t, offset, value):
+        # Slices share their boundary instant; keep the series strictly increasing
+        if self.ts and t <= self.ts[-1]:
+            return
+        self.ts.append(t)
+        self.offset.append(offset)
+        self.values.append(float(value))
+
+    @staticmethod
+    def isoformat(t, offset):
+        tz = datetime.timezone(datetime.timedelta(minutes=offset))
+        return datetime.datetime.fromtimestamp(t, tz).isoformat()
+
+    @staticmethod
+    def number(v):
+        return int(v) if v.is_integer() else v
+
+    def records(self):
+        return [{"timestamp": self.isoformat(t, o), "value": self.number(v)}
+                for t, o, v in zip(self.ts, self.offset, self.values)]
+
+    def resample(self, step):
+        """Aggregate into local-time buckets of `step` seconds: min/max/mean/last/count."""
+        out = []
+        bucket = None
+        for t, o, v in zip(self.ts, self.offset, self.values):
+            local = t + o * 60
+            start = local - local % step
+            if bucket is None or start != bucket[0]:
+                if bucket:
+                    out.append(bucket)
+                bucket = [start, o, v, v, 0.0, 0, v]
+            bucket[2] = min(bucket[2], v)
+            bucket[3] = max(bucket[3], v)
+            bucket[4] += v
+            bucket[5] += 1
+            bucket[6] = v
+        if bucket:
+            out.append(bucket)
+        return [{"timestamp": self.isoformat(start - o * 60, o), "min": self.number(lo), "max": self.number(hi),
+                 "mean": round(total / n, 3), "last": self.number(last), "count": n}
+                for start, o, lo, hi, total, n, last in out]
+
+
+def time_slices(start, end, hours):
+    step = datetime.timedelta(hours=hours)
+    slices = []
+    while start < end:
+        slices.append((start, min(start + step, end)))
+        start += step
+    return slices
+
+
+def measurements_path(station, timeseries):
+    return f"/stations/{urllib.parse.quote(station, safe='')}/{urllib.parse.quote(timeseries, safe='')}/measurements.json"
+
+
+def submit_slices(pool, path, start, end, hours, fetch=api_get):
     params = {"prettyprint": "false"}
-    if args.start:
-        params["start"] = args.start
-    if args.end:
-        params["end"] = args.end
-    data = api_get(f"/stations/{station_id}/{ts}/measurements.json", params)
-    print(json.dumps(data))
+    return [pool.submit(fetch, path, dict(params, start=a.isoformat(), end=b.isoformat()))
+            for a, b in time_slices(start, end, hours)]
+
+
+def series_from_chunks(chunks):
+    series = Series()
+    for chunk in chunks:
+        for m in chunk if isinstance(chunk, list) else []:
+            if m.get("value") is not None:
+                series.append(m["timestamp"], m["value"])
+    return series
+
+
+def print_series(series, resample):
+    if resample:
+        print(json.dumps(series.resample(RESAMPLE_SECONDS[resample])))
+    else:
+        print(json.dumps(series.records()))
+
+
+def cmd_measurements(args):
+    path = measurements_path(args.id, args.timeseries)
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    start = parse_time(args.start, now) if args.start else None
+    end = parse_time(args.end, now) if args.end else now
+    if args.local:
+        print_series(store_range(args.store_dir, args.id, args.timeseries, start, end), args.resample)
+        return
+    if start is None or end is None:
+        # Let the API interpret anything we do not understand, in one request
+        chunks = [api_get(path, {"prettyprint": "false", "start": args.start, "end": args.end})]
+    else:
+        workers = max(1, min(args.workers, len(time_slices(start, end, args.slice_hours))))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            chunks = [f.result() for f in submit_slices(pool, path, start, end, args.slice_hours)]
+    print_series(series_from_chunks(chunks), args.resample)
+
+
+def store_file(store_dir, station, timeseries):
+    return pathlib.Path(store_dir) / urllib.parse.quote(station, safe="") / f"{urllib.parse.quote(timeseries, safe='')}.bin"
+
+
+class RecordTimes:
+    """Sequence view of the timestamps in a mapped store file, for bisect."""
+
+    def __init__(self, buf):
+        self.buf = buf
+
+    def __len__(self):
+        return len(self.buf) // RECORD.size
+
+    def __getitem__(self, i):
+        return RECORD.unpack_from(self.buf, i * RECORD.size)[0]
+
+
+def store_last(path):
+    """Timestamp of the last complete record, or None."""
+    try:
+        size = path.stat().st_size
+    except OSError:
+        return None
+    if size < RECORD.size:
+        return None
+    with open(path, "rb") as f:
+        f.seek((size // RECORD.size - 1) * RECORD.size)
+        return RECORD.unpack(f.read(RECORD.size))[0]
+
+
+def local_offset(t):
+    dt = datetime.datetime.fromtimestamp(t, LOCAL_TZ)
+    return int(dt.utcoffset().total_seconds() // 60)
+
+
+def store_range(store_dir, station, timeseries, start, end):
+    """Binary-search [start, end] in the memory-mapped store file."""
+    path = store_file(store_dir, station, timeseries)
+    series = Series()
+    if not path.exists() or path.stat().st_size < RECORD.size:
+        print(json.dumps({"error": f"No stored data for {station}/{timeseries}. Run 'sync' first."}))
+        sys.exit(1)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        times = RecordTimes(buf)
+        lo = bisect.bisect_left(times, start.timestamp()) if start else 0
+        hi = bisect.bisect_right(times, end.timestamp()) if end else len(times)
+        for i in range(lo, hi):
+            t, v = RECORD.unpack_from(buf, i * RECORD.size)
+            series.add(t, local_offset(t), v)
+    return series
+
+
+def cmd_sync(args):
+    """Append everything after the last stored timestamp for each station/timeseries."""
+    stations = list(args.ids)
+    if args.file:
+        with open(args.file, "r") as f:
+            stations += [line.split("#", 1)[0].strip() for line in f]
+    stations = list(dict.fromkeys(s for s in stations if s))
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    earliest = parse_time(MAX_HISTORY, now)
+    first_start = parse_time(args.start, now) if args.start else earliest
+    if first_start is None:
+        print(json.dumps({"error": f"Invalid --start '{args.start}', use ISO 8601 or a period like P7D"}))
+        sys.exit(1)
+    pending = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for station in stations:
+            for ts in args.timeseries or ["W"]:
+                last = store_last(store_file(args.store_dir, station, ts))
+                start = (datetime.datetime.fromtimestamp(last + 1, datetime.timezone.utc) if last is not None
+                         else first_start)
+                start = max(start, earliest)
+                # fetch_json raises, so one unknown station is reported instead of ending the sync
+                pending[(station, ts)] = (last, submit_slices(pool, measurements_path(station, ts), start, now,
+                                                              args.slice_hours, fetch=fetch_json))
+        result = {}
+        for (station, ts), (last, futures) in pending.items():
+            try:
+                series = series_from_chunks([f.result() for f in futures])
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                # Nothing is appended unless every slice arrived, so the next run fills the whole gap
+                result.setdefault(station, {})[ts] = {"error": error_text(e)}
+                continue
+            path = store_file(args.store_dir, station, ts)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            records = [RECORD.pack(int(t), v) for t, v in zip(series.ts, series.values)
+                       if last is None or int(t) > last]
+            with open(path, "ab") as f:
+                # Drop a torn record from an interrupted write so appends stay record-aligned
+                size = f.tell()
+                if size % RECORD.size:
+                    f.truncate(size - size % RECORD.size)
+                f.write(b"".join(records))
+            result.setdefault(station, {})[ts] = {"appended": len(records),
+                                                  "records": path.stat().st_size // RECORD.size}
+    print(json.dumps(result))
+
+
+def crossings(prev, cur, thresholds):
+    out = []
+    for t in thresholds:
+        if prev < t <= cur:
+            out.append({"threshold": t, "direction": "up"})
+        elif cur < t <= prev:
+            out.append({"threshold": t, "direction": "down"})
+    return out
+
+
+def monitor_poll(args, state):
+    """Fetch current values once and return events for stations with a new measurement.
+
+    Updates are collected first and applied to state only after every station
+    was processed, so a poll that raises changes nothing.
+    """
+    params = {"prettyprint": "false", "includeTimeseries": "true", "includeCurrentMeasurement": "true",
+              "timeseries": args.timeseries, "waters": args.water}
+    stations = fetch_json("/stations.json", params)
+    events, updates = [], {}
+    for st in stations:
+        series = next((t for t in st.get("timeseries", []) if t.get("shortname") == args.timeseries), None)
+        cm = (series or {}).get("currentMeasurement")
+        if not cm or cm.get("value") is None:
+            continue
+        uuid = st.get("uuid")
+        prev = state.get(uuid)
+        if prev and prev["timestamp"] == cm["timestamp"]:
+            continue
+        t = datetime.datetime.fromisoformat(cm["timestamp"]).timestamp()
+        updates[uuid] = {"timestamp": cm["timestamp"], "t": t, "value": cm["value"],
+                         "stateMnwMhw": cm.get("stateMnwMhw")}
+        event = {"uuid": uuid, "shortname": st.get("shortname"), "water": (st.get("water") or {}).get("shortname"),
+                 "timeseries": args.timeseries, "unit": series.get("unit"), "timestamp": cm["timestamp"],
+                 "value": cm["value"], "trend": cm.get("trend"), "stateMnwMhw": cm.get("stateMnwMhw")}
+        if prev:
+            event["previous"] = {"timestamp": prev["timestamp"], "value": prev["value"]}
+            hours = (t - prev["t"]) / 3600
+            if hours > 0:
+                event["rate_per_hour"] = round((cm["value"] - prev["value"]) / hours, 3)
+            hits = crossings(prev["value"], cm["value"], args.threshold or [])
+            if hits:
+                event["crossings"] = hits
+            if prev.get("stateMnwMhw") != cm.get("stateMnwMhw"):
+                event["state_change"] = [prev.get("stateMnwMhw"), cm.get("stateMnwMhw")]
+        events.append(event)
+    state.update(updates)
+    return events, len(stations)
+
+
+def cmd_monitor(args):
+    path = CACHE_DIR / f"monitor_{args.timeseries}_{args.water or 'all'}.json"
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    while True:
+        started = time.monotonic()
+        try:
+            events, total = monitor_poll(args, state)
+        except (urllib.error.URLError, OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # Report the failed poll and try again next interval with the previous state
+            sys.stdout.write(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "error": error_text(e)}) + "\n")
+            sys.stdout.flush()
+            if not args.interval:
+                sys.exit(1)
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+            continue
+        if args.changes_only:
+            events = [e for e in events if "crossings" in e or "state_change" in e]
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+        sys.stdout.write(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "stations": total,
+                                     "updated": events}) + "\n")
+        sys.stdout.flush()
+        if not args.interval:
+            return
+        time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
 
 
 def cmd_waters(args):
@@ -96,9 +440,34 @@ def main():
     p_meas.add_argument("timeseries", help="Timeseries type (e.g. W, Q, WT)")
     p_meas.add_argument("--start", help="Start time (ISO 8601 or period like P7D)")
     p_meas.add_argument("--end", help="End time (ISO 8601)")
+    p_meas.add_argument("--local", action="store_true", help="Serve from the local store filled by 'sync'")
+    p_meas.add_argument("--store-dir", default=STORE_DIR, help=f"Local store directory (default: {STORE_DIR})")
+    p_meas.add_argument("--resample", choices=list(RESAMPLE_SECONDS), help="Aggregate to min/max/mean/last per bucket")
+    p_meas.add_argument("--slice-hours", type=int, default=SLICE_HOURS,
+                        help=f"Hours per parallel request (default: {SLICE_HOURS})")
+    p_meas.add_argument("--workers", type=int, default=MEASUREMENT_WORKERS,
+                        help=f"Concurrent requests (default: {MEASUREMENT_WORKERS})")
 
     sub.add_parser("waters", help="List all water bodies")
 
+    p_sync = sub.add_parser("sync", help="Append new measurements to the local store")
+    p_sync.add_argument("ids", nargs="*", help="Station UUID(s), name(s), or gauge number(s)")
+    p_sync.add_argument("--file", help="File with one station ID per line")
+    p_sync.add_argument("--timeseries", action="append", help="Timeseries to store (repeatable, default: W)")
+    p_sync.add_argument("--start", help=f"Start for stations not yet stored (default: {MAX_HISTORY})")
+    p_sync.add_argument("--store-dir", default=STORE_DIR, help=f"Local store directory (default: {STORE_DIR})")
+    p_sync.add_argument("--slice-hours", type=int, default=SLICE_HOURS,
+                        help=f"Hours per parallel request (default: {SLICE_HOURS})")
+    p_sync.add_argument("--workers", type=int, default=MEASUREMENT_WORKERS,
+                        help=f"Concurrent requests (default: {MEASUREMENT_WORKERS})")
+
+    p_mon = sub.add_parser("monitor", help="Stations with a new current measurement since the last poll")
+    p_mon.add_argument("--timeseries", default="W", help="Timeseries to watch (default: W)")
+    p_mon.add_argument("--water", help="Only stations on this water body (e.g. RHEIN)")
+    p_mon.add_argument("--threshold", type=float, action="append", help="Report crossings of this value (repeatable)")
+    p_mon.add_argument("--changes-only", action="store_true", help="Only report threshold crossings and state changes")
+    p_mon.add_argument("--interval", type=float, default=0, help="Keep polling every N seconds (default: poll once)")
+
     args = parser.parse_args()
 
     commands = {
@@ -106,6 +475,8 @@ def main():
         "station": cmd_station,
         "measurements": cmd_measurements,
         "waters": cmd_waters,
+        "monitor": cmd_monitor,
+        "sync": cmd_sync,
     }
     commands[args.command](args)
 
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Copy shared/httpclient.py into the skills and rebuild their upload zips.
+
+shared/httpclient.py is the only file to edit; every skill that makes HTTP
+requests carries a copy next to its search.py so the skill folder and its zip
+stay self-contained. --check changes nothing and exits 1 if a copy in a skill
+folder or zip differs from the shared file.
+
+    python3 tools/build_skills.py [--check]
+"""
+
+import argparse
+import json
+import os
+import sys
+import zipfile
+
+REPO_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+SHARED = os.path.join(REPO_DIR, "shared", "httpclient.py")
+
+# skill: (zip name, files in the zip, whether the zip entries sit under "<skill>/")
+SKILLS = {
+    "abfallnavi": ("searching-abfallnavi.zip", ["skill.md", "search.py", "httpclient.py"], True),
+    "autobahn": ("searching-autobahn.zip", ["skill.md", "search.py", "httpclient.py"], True),
+    "dwd": ("searching-dwd-weather.zip", ["skill.md", "search.py", "httpclient.py"], False),
+    "handelsregister": ("searching-handelsregister.zip", ["scripts/handelsregister.py", "skill.md", "search.py"], True),
+    "hilfsmittel": ("searching-hilfsmittel.zip", ["skill.md", "search.py", "httpclient.py"], True),
+    "nina": ("searching-nina-warnings.zip", ["skill.md", "search.py", "httpclient.py"], False),
+    "pegel-online": ("searching-pegel-online.zip", ["skill.md", "search.py", "httpclient.py"], False),
+    "travelwarning": ("searching-travelwarning.zip", ["skill.md", "search.py", "httpclient.py"], False),
+}
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def stale_copies(shared):
+    """Paths (relative to the repo) whose httpclient.py differs from the shared one."""
+    stale = []
+    for skill, (zip_name, files, prefixed) in SKILLS.items():
+        if "httpclient.py" not in files:
+            continue
+        copy = os.path.join(skill, "httpclient.py")
+        if not os.path.exists(os.path.join(REPO_DIR, copy)) or read(os.path.join(REPO_DIR, copy)) != shared:
+            stale.append(copy)
+        entry = f"{skill}/httpclient.py" if prefixed else "httpclient.py"
+        try:
+            with zipfile.ZipFile(os.path.join(REPO_DIR, skill, zip_name)) as z:
+                zipped = z.read(entry)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            zipped = None
+        if zipped != shared:
+            stale.append(f"{skill}/{zip_name}:{entry}")
+    return stale
+
+
+def build_zip(skill, zip_name, files, prefixed):
+    skill_dir = os.path.join(REPO_DIR, skill)
+    path = os.path.join(skill_dir, zip_name)
+    tmp = path + ".tmp"
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as z:
+        if prefixed:
+            # Directory entries first, as zip(1) writes them
+            dirs = sorted({os.path.dirname(f) for f in files} - {""})
+            for d in [""] + dirs:
+                z.writestr(zipfile.ZipInfo(f"{skill}/{d}/" if d else f"{skill}/"), b"")
+        for f in files:
+            z.write(os.path.join(skill_dir, f), f"{skill}/{f}" if prefixed else f)
+    os.replace(tmp, path)
+    return os.path.relpath(path, REPO_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync shared/httpclient.py into the skills and rebuild the zips")
+    parser.add_argument("--check", action="store_true", help="Only report copies that differ, exit 1 if any")
+    args = parser.parse_args()
+
+    shared = read(SHARED)
+    if args.check:
+        stale = stale_copies(shared)
+        print(json.dumps({"ok": not stale, "stale": stale}, indent=2))
+        sys.exit(1 if stale else 0)
+
+    built = []
+    for skill, (zip_name, files, prefixed) in SKILLS.items():
+        if "httpclient.py" in files:
+            with open(os.path.join(REPO_DIR, skill, "httpclient.py"), "wb") as f:
+                f.write(shared)
+        built.append(build_zip(skill, zip_name, files, prefixed))
+    print(json.dumps({"synced": os.path.relpath(SHARED, REPO_DIR), "zips": built}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
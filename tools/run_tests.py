@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Run the unit tests of every skill that has a tests/ folder.
+
+Tests use unittest only, so they run without installing anything. Every skill
+names its module search.py, so each skill's tests run in their own process.
+Exits 1 if any skill's tests fail.
+
+    python3 tools/run_tests.py [skill ...]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def skills_with_tests():
+    return sorted(d for d in os.listdir(REPO_DIR) if os.path.isdir(os.path.join(REPO_DIR, d, "tests")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run each skill's tests/ with unittest")
+    parser.add_argument("skills", nargs="*", help="Skills to test (default: all with a tests/ folder)")
+    args = parser.parse_args()
+
+    available = skills_with_tests()
+    unknown = sorted(set(args.skills) - set(available))
+    if unknown:
+        parser.error(f"no tests/ folder in: {', '.join(unknown)}")
+
+    failed = []
+    for skill in args.skills or available:
+        tests = os.path.join(REPO_DIR, skill, "tests")
+        print(f"== {skill}", flush=True)
+        if subprocess.call([sys.executable, "-m", "unittest", "discover", "-s", tests, "-t", tests]):
+            failed.append(skill)
+    if failed:
+        print(f"failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
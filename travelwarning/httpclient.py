@@ -0,0 +1,213 @@
+"""Keep-alive HTTP client shared by the skill scripts.
+
+urllib.request.urlopen opens a new TCP and TLS connection for every request.
+urlopen() here is a drop-in replacement that keeps finished connections in a
+per-host pool and hands them to the next request to the same host. Errors,
+including a body cut short or timing out while it is read, are raised as
+urllib.error.HTTPError/URLError, so callers handle them as before.
+
+Every skill ships a copy of this file next to its search.py. Edit only
+shared/httpclient.py; tools/build_skills.py copies it into the skills.
+"""
+
+import base64
+import http.client
+import io
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+MAX_IDLE_PER_HOST = 16
+IDLE_TIMEOUT = 30
+MAX_REDIRECTS = 5
+USER_AGENT = "Python-urllib/%s" % urllib.request.__version__
+
+# A pooled connection the server has closed in the meantime fails on first use
+STALE_ERRORS = (ConnectionResetError, ConnectionAbortedError, BrokenPipeError, http.client.BadStatusLine)
+
+
+class Response:
+    """Response of a pooled connection. Gives the connection back once the body is read or the response closed."""
+
+    def __init__(self, pool, key, conn, resp, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.url = url
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+
+    def read(self, amt=None):
+        data = self._body(self._resp.read, amt)
+        if self._resp.isclosed():
+            self.close()
+        return data
+
+    def peek(self, n=0):
+        return self._body(self._resp.peek, n)
+
+    def _body(self, method, *args):
+        try:
+            return method(*args)
+        except (OSError, http.client.HTTPException) as e:
+            # IncompleteRead, timeouts, resets: the connection is in an unknown state
+            self._discard()
+            raise urllib.error.URLError(e)
+
+    def getcode(self):
+        return self.status
+
+    def close(self):
+        if self._conn is None:
+            return
+        # Only a fully read body leaves the connection in a reusable state
+        if self._resp.isclosed() and not self._resp.will_close:
+            conn, self._conn = self._conn, None
+            self._pool.release(self._key, conn)
+        else:
+            self._discard()
+
+    def _discard(self):
+        conn, self._conn = self._conn, None
+        self._resp.close()
+        if conn is not None:
+            conn.close()
+
+    def __getattr__(self, name):
+        # readinto, getheader, ... of the underlying http.client.HTTPResponse
+        return getattr(self._resp, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    """Idle keep-alive connections per (scheme, host, port), at most max_idle each, closed after idle_timeout."""
+
+    def __init__(self, max_idle=MAX_IDLE_PER_HOST, idle_timeout=IDLE_TIMEOUT, context=None):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.context = context or ssl.create_default_context()
+        self.proxies = urllib.request.getproxies()
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def _connect(self, key, timeout):
+        scheme, host, port = key
+        proxy = self.proxies.get(scheme)
+        if proxy and not urllib.request.proxy_bypass(host):
+            p = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            headers = {}
+            if p.username:
+                credentials = f"{urllib.parse.unquote(p.username)}:{urllib.parse.unquote(p.password or '')}"
+                headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode()
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(p.hostname, p.port or 80, timeout=timeout, context=self.context)
+                conn.set_tunnel(host, port, headers=headers)
+            else:
+                conn = http.client.HTTPConnection(p.hostname, p.port or 80, timeout=timeout)
+                conn.proxy_headers = headers
+            return conn
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self.context)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def acquire(self, key, timeout):
+        """(connection, reused): the most recently used idle connection to key, or a new one."""
+        now = time.monotonic()
+        expired = []
+        conn = None
+        with self.lock:
+            idle = self.idle.get(key, [])
+            while idle:
+                candidate, since = idle.pop()
+                if now - since <= self.idle_timeout:
+                    conn = candidate
+                    break
+                expired.append(candidate)
+        for old in expired:
+            old.close()
+        if conn is None:
+            return self._connect(key, timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def release(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def _send(self, key, method, target, body, headers, timeout):
+        """Send one request, retrying once on a fresh connection if a pooled one turned out to be closed."""
+        while True:
+            conn, reused = self.acquire(key, timeout)
+            try:
+                conn.request(method, target, body, dict(headers, **getattr(conn, "proxy_headers", {})))
+                return conn, conn.getresponse()
+            except STALE_ERRORS as e:
+                conn.close()
+                if not reused:
+                    raise urllib.error.URLError(e)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise urllib.error.URLError(e)
+
+    def urlopen(self, req, timeout=15):
+        """Like urllib.request.urlopen: follows redirects and raises HTTPError for non-2xx responses."""
+        if isinstance(req, str):
+            req = urllib.request.Request(req)
+        url, method, body = req.full_url, req.get_method(), req.data
+        headers = dict(req.header_items())
+        if not any(name.lower() == "user-agent" for name in headers):
+            headers["User-Agent"] = USER_AGENT
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            scheme = parts.scheme.lower()
+            key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+            target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+            if scheme == "http" and self.proxies.get("http") and not urllib.request.proxy_bypass(parts.hostname):
+                target = url
+            conn, resp = self._send(key, method, target, body, headers, timeout)
+            response = Response(self, key, conn, resp, url)
+            location = resp.headers.get("Location")
+            if resp.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                response.close()
+                url = urllib.parse.urljoin(url, location)
+                if resp.status == 303 or (resp.status in (301, 302) and method == "POST"):
+                    method, body = "GET", None
+                continue
+            if not 200 <= resp.status < 300:
+                data = response.read()
+                response.close()
+                raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+            return response
+        raise urllib.error.HTTPError(url, resp.status, "Too many redirects", resp.headers, None)
+
+
+_pool = ConnectionPool()
+
+
+def urlopen(req, timeout=15):
+    """urlopen over the process-wide connection pool."""
+    return _pool.urlopen(req, timeout)
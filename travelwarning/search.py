@@ -2,22 +2,47 @@
 """Query the Auswärtiges Amt travel warning API."""
 
 import argparse
+import bisect
+import concurrent.futures
 import json
+import math
+import os
+import pathlib
 import re
 import sys
+import tempfile
+import time
 import urllib.request
 import urllib.error
+from html.parser import HTMLParser
+
+import httpclient
 
 BASE_URL = "https://www.auswaertiges-amt.de/opendata"
 
 MAX_ITEMS = 10
 
+CACHE_DIR = pathlib.Path(tempfile.gettempdir()) / "travelwarning_cache"
+COUNTRY_INDEX_PATH = CACHE_DIR / "countries.json"
+EMBASSY_INDEX_PATHS = {
+    "/representativesInCountry": CACHE_DIR / "embassies_abroad.json",
+    "/representativesInGermany": CACHE_DIR / "embassies_in_germany.json",
+}
+COUNTRY_INDEX_TTL = 900
+TEXT_STORE_PATH = CACHE_DIR / "texts.json"
+DETAIL_WORKERS = 8
+SEARCH_INDEX_PATH = CACHE_DIR / "search_index.json"
+SNIPPET_CHARS = 200
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
 
 def api_get(path):
     url = f"{BASE_URL}{path}"
     try:
         req = urllib.request.Request(url, headers={"Accept": "application/json"})
-        with urllib.request.urlopen(req, timeout=15) as resp:
+        with httpclient.urlopen(req, timeout=15) as resp:
             return json.loads(resp.read().decode("utf-8"))
     except urllib.error.HTTPError as e:
         print(json.dumps({"error": f"HTTP {e.code} for {url}"}))
@@ -27,34 +52,164 @@ def api_get(path):
         sys.exit(1)
 
 
+def api_get_conditional(path, validators):
+    """Like api_get, but sends the cached ETag/Last-Modified and returns (None, validators) on 304."""
+    url = f"{BASE_URL}{path}"
+    headers = {"Accept": "application/json"}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("lastModified"):
+        headers["If-Modified-Since"] = validators["lastModified"]
+    try:
+        req = urllib.request.Request(url, headers=headers)
+        with httpclient.urlopen(req, timeout=15) as resp:
+            data = json.loads(resp.read().decode("utf-8"))
+            fresh = {"etag": resp.headers.get("ETag") or "", "lastModified": resp.headers.get("Last-Modified") or ""}
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, validators
+        print(json.dumps({"error": f"HTTP {e.code} for {url}"}))
+        sys.exit(1)
+    except urllib.error.URLError as e:
+        print(json.dumps({"error": f"Connection failed: {e.reason}"}))
+        sys.exit(1)
+    return data, fresh
+
+
+def error_text(e):
+    if isinstance(e, urllib.error.HTTPError):
+        return f"HTTP {e.code}"
+    return str(getattr(e, "reason", e))
+
+
+class TextExtractor(HTMLParser):
+    """Single-pass HTML to plain text: block elements become line breaks, script/style are dropped."""
+
+    BLOCK_TAGS = {"p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "blockquote",
+                  "h1", "h2", "h3", "h4", "h5", "h6"}
+    SKIP_TAGS = {"script", "style"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip = max(0, self.skip - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+    def text(self):
+        lines = (" ".join(line.split()) for line in "".join(self.parts).split("\n"))
+        return "\n".join(line for line in lines if line)
+
+
 def strip_html(text):
     """Remove HTML tags for compact output."""
-    return re.sub(r"<[^>]+>", "", text).strip() if text else ""
+    if not text:
+        return ""
+    parser = TextExtractor()
+    parser.feed(text)
+    parser.close()
+    return parser.text()
 
 
-def cmd_list(args):
-    data = api_get("/travelwarning")
+def list_item(cid, entry):
+    return {
+        "contentId": str(cid),
+        "lastModified": entry.get("lastModified"),
+        "title": entry.get("title"),
+        "countryCode": entry.get("CountryCode", entry.get("countryCode")),
+        "countryName": entry.get("CountryName", entry.get("countryName")),
+        "warning": entry.get("warning", False),
+        "partialWarning": entry.get("partialWarning", False),
+        "situationWarning": entry.get("situationWarning", False),
+        "situationPartWarning": entry.get("situationPartWarning", False),
+    }
+
+
+def list_items(data):
     resp = data.get("response", data)
-    content_list = resp.get("contentList", [])
-    warnings = []
-    for cid in content_list:
+    items = []
+    for cid in resp.get("contentList", []):
         entry = resp.get(str(cid))
-        if not entry or not isinstance(entry, dict):
-            continue
-        item = {
-            "contentId": str(cid),
-            "lastModified": entry.get("lastModified"),
-            "title": entry.get("title"),
-            "countryCode": entry.get("CountryCode", entry.get("countryCode")),
-            "countryName": entry.get("CountryName", entry.get("countryName")),
-            "warning": entry.get("warning", False),
-            "partialWarning": entry.get("partialWarning", False),
-            "situationWarning": entry.get("situationWarning", False),
-            "situationPartWarning": entry.get("situationPartWarning", False),
-        }
-        if args.country and item.get("countryCode", "").upper() != args.country.upper():
-            continue
-        warnings.append(item)
+        if entry and isinstance(entry, dict):
+            items.append(list_item(cid, entry))
+    return items
+
+
+class CountryIndex:
+    """The /travelwarning list keyed by contentId, country code and German country name."""
+
+    def __init__(self, items):
+        self.items = items
+        self.by_id = {item["contentId"]: item for item in items}
+        self.by_code = {(item["countryCode"] or "").upper(): item for item in items if item["countryCode"]}
+        self.by_name = {(item["countryName"] or "").upper(): item for item in items if item["countryName"]}
+
+    def lookup(self, country):
+        """Entry for a 2-letter code or a German country name, or None."""
+        key = country.strip().upper()
+        if len(key) == 2 and key.isalpha() and key in self.by_code:
+            return self.by_code[key]
+        return self.by_name.get(key)
+
+
+def load_cached_index(path, endpoint, build, refresh=False):
+    """build(document) of an endpoint, cached in path and revalidated after COUNTRY_INDEX_TTL.
+
+    Revalidation is a conditional GET; on 304 the cached index stays valid and
+    is not rebuilt.
+    """
+    try:
+        with open(path, "r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+    if not isinstance(cached, dict) or cached.get("index") is None:
+        cached = {"fetched": 0, "validators": {}, "index": None}
+    if not refresh and time.time() - cached["fetched"] < COUNTRY_INDEX_TTL:
+        return cached["index"]
+
+    data, validators = api_get_conditional(endpoint, cached["validators"])
+    if data is not None:
+        cached["index"] = build(data)
+    cached["fetched"] = time.time()
+    cached["validators"] = validators
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(cached, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return cached["index"]
+
+
+def load_country_index(refresh=False):
+    """Country index from the local cache, revalidated against /travelwarning.
+
+    Each entry keeps its lastModified, so callers can tell which countries changed.
+    """
+    return CountryIndex(load_cached_index(COUNTRY_INDEX_PATH, "/travelwarning", list_items, refresh))
+
+
+def cmd_list(args):
+    index = load_country_index(args.refresh)
+    if args.country:
+        item = index.lookup(args.country)
+        warnings = [item] if item else []
+    else:
+        warnings = index.items
     total = len(warnings)
     result = {"warnings": warnings[:args.limit]}
     if total > args.limit:
@@ -63,7 +218,248 @@ def cmd_list(args):
     print(json.dumps(result))
 
 
+def fetch_detail(content_id):
+    """Detail entry of one country. Raises on errors instead of exiting, for bulk use."""
+    req = urllib.request.Request(f"{BASE_URL}/travelwarning/{content_id}", headers={"Accept": "application/json"})
+    with httpclient.urlopen(req, timeout=15) as resp:
+        data = json.loads(resp.read().decode("utf-8"))
+    entry = data.get("response", data).get(str(content_id))
+    if not entry:
+        raise ValueError(f"No data for contentId {content_id}")
+    return entry
+
+
+def load_text_store():
+    try:
+        with open(TEXT_STORE_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_text_store(store):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = TEXT_STORE_PATH.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(store, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, TEXT_STORE_PATH)
+
+
+def refresh_text_store(workers):
+    """Fetch the details of every country whose lastModified changed. Returns (store, summary)."""
+    started = time.monotonic()
+    index = load_country_index(refresh=True)
+    store = load_text_store()
+    stale = [item for item in index.items if store.get(item["contentId"], {}).get("lastModified") != item["lastModified"]]
+    removed = [cid for cid in store if cid not in index.by_id]
+    for cid in removed:
+        del store[cid]
+
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_detail, item["contentId"]): item for item in stale}
+        for future in concurrent.futures.as_completed(futures):
+            item = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                errors.append({"contentId": item["contentId"], "countryName": item["countryName"], "error": error_text(e)})
+                continue
+            # Keyed to the list's lastModified, which is what the next run compares against
+            store[item["contentId"]] = dict(item, content=strip_html(entry.get("content", "")))
+
+    if stale or removed:
+        save_text_store(store)
+        sync_search_index(store)
+    return store, {
+        "countries": len(store),
+        "updated": len(stale) - len(errors),
+        "unchanged": len(index.items) - len(stale),
+        "removed": len(removed),
+        "errors": errors,
+        "store": str(TEXT_STORE_PATH),
+        "_seconds": round(time.monotonic() - started, 2),
+    }
+
+
+def cmd_detail_all(args):
+    _, summary = refresh_text_store(args.workers)
+    print(json.dumps(summary))
+
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lower-cased word tokens of at least two characters; digits-only tokens are kept (e.g. years)."""
+    return [t for t in TOKEN_RE.findall(text.casefold()) if len(t) > 1]
+
+
+class SearchIndex:
+    """Inverted index over the text store: term -> {contentId: term frequency}, plus document lengths.
+
+    Documents carry the lastModified they were indexed at, so sync() only
+    re-tokenizes the countries whose text changed.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.docs = data.get("docs", {})
+        self.postings = data.get("postings", {})
+        self._terms = None
+
+    def add(self, cid, entry):
+        counts = {}
+        for term in tokenize(entry.get("content", "")):
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[cid] = tf
+        self.docs[cid] = {"lastModified": entry.get("lastModified"), "length": sum(counts.values())}
+
+    def remove(self, cid):
+        if self.docs.pop(cid, None) is None:
+            return
+        for term in [t for t, docs in self.postings.items() if cid in docs]:
+            docs = self.postings[term]
+            del docs[cid]
+            if not docs:
+                del self.postings[term]
+
+    def sync(self, store):
+        """Bring the index in line with the text store. Returns True if anything changed."""
+        changed = False
+        for cid in [cid for cid in self.docs if cid not in store]:
+            self.remove(cid)
+            changed = True
+        for cid, entry in store.items():
+            if cid in self.docs and self.docs[cid]["lastModified"] == entry.get("lastModified"):
+                continue
+            self.remove(cid)
+            self.add(cid, entry)
+            changed = True
+        if changed:
+            self._terms = None
+        return changed
+
+    def expand(self, term):
+        """Index terms for one query term; a trailing * matches every term with that prefix."""
+        if not term.endswith("*"):
+            return [term] if term in self.postings else []
+        prefix = term.rstrip("*")
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + "\U0010ffff")
+        return self._terms[start:end]
+
+    def search(self, query, require_all=False):
+        """BM25-ranked (contentId, score, matched terms) for a query, best first."""
+        n = len(self.docs)
+        if not n:
+            return []
+        avg_len = sum(doc["length"] for doc in self.docs.values()) / n or 1
+        scores = {}
+        matched = {}
+        groups = []
+        for word in query.casefold().split():
+            terms = self.expand(word) if word.endswith("*") else [t for t in tokenize(word) if t in self.postings]
+            hits = set()
+            for term in terms:
+                docs = self.postings[term]
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for cid, tf in docs.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.docs[cid]["length"] / avg_len)
+                    scores[cid] = scores.get(cid, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    matched.setdefault(cid, set()).add(term)
+                    hits.add(cid)
+            groups.append(hits)
+        if require_all and groups:
+            keep = set.intersection(*groups)
+            scores = {cid: score for cid, score in scores.items() if cid in keep}
+        ranked = sorted(scores.items(), key=lambda kv: -kv[1])
+        return [(cid, score, sorted(matched[cid])) for cid, score in ranked]
+
+    def to_json(self):
+        return {"docs": self.docs, "postings": self.postings}
+
+
+def load_search_index():
+    try:
+        with open(SEARCH_INDEX_PATH, "r") as f:
+            return SearchIndex(json.load(f))
+    except (OSError, ValueError):
+        return SearchIndex()
+
+
+def sync_search_index(store):
+    """Search index updated for the given text store; written back only if a country changed."""
+    index = load_search_index()
+    if index.sync(store):
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = SEARCH_INDEX_PATH.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(index.to_json(), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, SEARCH_INDEX_PATH)
+    return index
+
+
+def snippet(text, terms, width=SNIPPET_CHARS):
+    """About width characters of text around the first occurrence of any matched term."""
+    # Terms are casefolded, and casefolding can change lengths (ß -> ss), so search the
+    # folded text and map the hit back to its offset in the original
+    folded, origin = [], []
+    for i, ch in enumerate(text):
+        low = ch.casefold()
+        folded.append(low)
+        origin.extend([i] * len(low))
+    lowered = "".join(folded)
+    found = [origin[m.start()] for m in (re.search(r"\b" + re.escape(term), lowered) for term in terms) if m]
+    start = max(0, min(found) - width // 3) if found else 0
+    if start:
+        # Start on a word boundary
+        start = text.find(" ", start, min(found)) + 1 or start
+    end = min(len(text), start + width)
+    out = " ".join(text[start:end].split())
+    return ("…" if start else "") + out + ("…" if end < len(text) else "")
+
+
+def cmd_search(args):
+    started = time.monotonic()
+    if args.refresh:
+        store, _ = refresh_text_store(args.workers)
+    else:
+        store = load_text_store()
+    if not store:
+        print(json.dumps({"error": "Text store is empty, run 'detail --all' first (or search with --refresh)"}))
+        sys.exit(1)
+    index = sync_search_index(store)
+    hits = index.search(args.query, require_all=args.all_terms)
+    results = []
+    for cid, score, terms in hits[:args.limit]:
+        entry = store[cid]
+        results.append({
+            "contentId": cid,
+            "countryCode": entry.get("countryCode"),
+            "countryName": entry.get("countryName"),
+            "title": entry.get("title"),
+            "warning": entry.get("warning", False),
+            "partialWarning": entry.get("partialWarning", False),
+            "score": round(score, 3),
+            "matched": terms,
+            "snippet": snippet(entry.get("content", ""), terms),
+        })
+    out = {"query": args.query, "results": results}
+    if len(hits) > args.limit:
+        out["_total"] = len(hits)
+        out["_showing"] = args.limit
+    out["_ms"] = round((time.monotonic() - started) * 1000, 1)
+    print(json.dumps(out))
+
+
 def cmd_detail(args):
+    if args.all:
+        cmd_detail_all(args)
+        return
     data = api_get(f"/travelwarning/{args.content_id}")
     resp = data.get("response", data)
     entry = resp.get(str(args.content_id))
@@ -88,26 +484,11 @@ def cmd_detail(args):
     print(json.dumps(result))
 
 
-def resolve_country_name(code):
-    """Resolve a 2-letter ISO code to the German country name via travelwarning API."""
-    data = api_get("/travelwarning")
+def embassy_buckets(data):
+    """All representations in list order, plus their positions keyed by upper-cased country name."""
     resp = data.get("response", data)
+    items, buckets = [], {}
     for cid in resp.get("contentList", []):
-        entry = resp.get(str(cid))
-        if not entry or not isinstance(entry, dict):
-            continue
-        cc = (entry.get("CountryCode") or entry.get("countryCode") or "").upper()
-        if cc == code.upper():
-            return entry.get("CountryName") or entry.get("countryName") or ""
-    return None
-
-
-def cmd_embassies(args, endpoint):
-    data = api_get(endpoint)
-    resp = data.get("response", data)
-    content_list = resp.get("contentList", [])
-    results = []
-    for cid in content_list:
         country_block = resp.get(str(cid))
         if not isinstance(country_block, dict):
             continue
@@ -125,17 +506,24 @@ def cmd_embassies(args, endpoint):
                 "fax": entry.get("fax"),
                 "website": entry.get("website"),
             }
-            results.append(item)
+            buckets.setdefault((item["country"] or "").upper(), []).append(len(items))
+            items.append(item)
+    return {"items": items, "buckets": buckets}
+
+
+def cmd_embassies(args, endpoint):
+    index = load_cached_index(EMBASSY_INDEX_PATHS[endpoint], endpoint, embassy_buckets, args.refresh)
     if args.country:
         query = args.country.strip()
-        # If it looks like a 2-letter ISO code, resolve to German country name
+        # A 2-letter ISO code is resolved to the German country name via the local country index
         if len(query) == 2 and query.isalpha():
-            resolved = resolve_country_name(query)
-            if resolved:
-                query = resolved
+            country = load_country_index(args.refresh).lookup(query)
+            if country and country["countryName"]:
+                query = country["countryName"]
         # Case-insensitive exact match on country name
-        query_upper = query.upper()
-        results = [r for r in results if (r.get("country") or "").upper() == query_upper]
+        results = [index["items"][i] for i in index["buckets"].get(query.upper(), [])]
+    else:
+        results = index["items"]
     total = len(results)
     out = {"representations": results[:args.limit]}
     if total > args.limit:
@@ -147,6 +535,7 @@ def cmd_embassies(args, endpoint):
 def add_common(p):
     p.add_argument("--limit", type=int, default=MAX_ITEMS, help=f"Max items (default: {MAX_ITEMS})")
     p.add_argument("--country", help="Filter by country code or name")
+    p.add_argument("--refresh", action="store_true", help=f"Revalidate the local indexes now (default: after {COUNTRY_INDEX_TTL}s)")
 
 
 def main():
@@ -157,7 +546,16 @@ def main():
     add_common(p_list)
 
     p_det = sub.add_parser("detail", help="Full warning text for a country")
-    p_det.add_argument("content_id", help="Content ID from list command")
+    p_det.add_argument("content_id", nargs="?", help="Content ID from list command")
+    p_det.add_argument("--all", action="store_true", help="Refresh the local text store for all countries (only changed ones are fetched)")
+    p_det.add_argument("--workers", type=int, default=DETAIL_WORKERS, help=f"Parallel requests for --all (default: {DETAIL_WORKERS})")
+
+    p_s = sub.add_parser("search", help="Full-text search over all warning texts, ranked by BM25")
+    p_s.add_argument("query", help="Search words; a trailing * matches a prefix (e.g. entführ*)")
+    p_s.add_argument("--limit", type=int, default=MAX_ITEMS, help=f"Max items (default: {MAX_ITEMS})")
+    p_s.add_argument("--all-terms", action="store_true", help="Only countries that match every search word")
+    p_s.add_argument("--refresh", action="store_true", help="Refresh the local text store (changed countries only) before searching")
+    p_s.add_argument("--workers", type=int, default=DETAIL_WORKERS, help=f"Parallel requests for --refresh (default: {DETAIL_WORKERS})")
 
     p_ea = sub.add_parser("embassies-abroad", help="German representations abroad")
     add_common(p_ea)
@@ -166,11 +564,15 @@ def main():
     add_common(p_eg)
 
     args = parser.parse_args()
+    if args.command == "detail" and not args.content_id and not args.all:
+        parser.error("detail needs a CONTENT_ID or --all")
 
     if args.command == "list":
         cmd_list(args)
     elif args.command == "detail":
         cmd_detail(args)
+    elif args.command == "search":
+        cmd_search(args)
     elif args.command == "embassies-abroad":
         cmd_embassies(args, "/representativesInCountry")
     elif args.command == "embassies-in-germany":
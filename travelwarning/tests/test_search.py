@@ -0,0 +1,23 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import search  # noqa: E402
+
+
+class SnippetTest(unittest.TestCase):
+    def test_hit_after_sharp_s(self):
+        # Casefolding turns ß into ss; the snippet must still be cut around the hit in the original text
+        text = "Die Straße ist groß. " * 40 + "Es besteht Entführungsrisiko in der Region. Ende. Ende."
+        out = search.snippet(text, ["entführungsrisiko"])
+        self.assertIn("Entführungsrisiko", out)
+
+    def test_folded_term_maps_to_original(self):
+        out = search.snippet("x " * 200 + "Die Hauptstraße ist gesperrt.", ["hauptstrasse"])
+        self.assertIn("Hauptstraße ist gesperrt", out)
+
+
+if __name__ == "__main__":
+    unittest.main()